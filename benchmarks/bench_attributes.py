@@ -0,0 +1,23 @@
+"""
+Attribute selectors without a tag name on a 100k-node page ( see attributeIndex ).
+
+    python benchmarks/bench_attributes.py [path/to/htmldom.py]
+"""
+import sys
+import timeit
+
+from common import loadHtmldom, nodeCount, tablePage
+
+htmldom = loadHtmldom( sys.argv )
+# 12500 rows of 8 nodes: tr, 3 td, a and 3 texts.
+page = tablePage( 12500, '<tr><td class="cell">x</td><td>y</td><td><a href="/p/%(i)d" title="t%(i)d">z</a></td></tr>' )
+dom = htmldom.HtmlDom().createDom( page )
+print( "%d nodes" % nodeCount( dom ) )
+
+for selector in [ "[title]", "[href^=/p/9]", "[title$=99]", "[href*=/12]", "[data-x]" ]:
+    def run():
+         # as after any change to the document.
+         dom.sorted = False
+         return dom.find( selector )
+    seconds = min( timeit.repeat( run, number = 1, repeat = 3 ) )
+    print( "%-16s %6d results %.3f s" % ( selector, run().length(), seconds ) )
@@ -0,0 +1,23 @@
+"""
+Memory retained by a parsed document, per 100k nodes ( see the node classes ).
+
+    python benchmarks/bench_memory.py [path/to/htmldom.py]
+"""
+import gc
+import sys
+import tracemalloc
+
+from common import loadHtmldom, nodeCount, tablePage
+
+htmldom = loadHtmldom( sys.argv )
+# 12500 rows of 7 nodes: tr, 3 td, br and 2 texts.
+page = tablePage( 12500, '<tr><td class="cell">x</td><td>y</td><td><br></td></tr>' )
+
+gc.collect()
+tracemalloc.start()
+dom = htmldom.HtmlDom().createDom( page )
+current, peak = tracemalloc.get_traced_memory()
+tracemalloc.stop()
+nodes = nodeCount( dom )
+print( "%d nodes: retained %.1f MB, %.1f MB per 100k nodes, peak %.1f MB" %
+       ( nodes, current / 1e6, current / 1e6 * 100000 / nodes, peak / 1e6 ) )
@@ -0,0 +1,32 @@
+"""
+The HtmlNodeList traversal methods on a big table, one timing per method
+( see uniqueNodes ).
+
+    python benchmarks/bench_traversal.py [path/to/htmldom.py] [rows]
+"""
+import sys
+import timeit
+
+from common import loadHtmldom, nodeCount, tablePage
+
+htmldom = loadHtmldom( sys.argv )
+rows = int( sys.argv[ -1 ] ) if sys.argv[ -1 ].isdigit() else 1000
+dom = htmldom.HtmlDom().createDom( tablePage( rows, '<tr><td>a%(i)d</td><td>b</td><td>c</td></tr>' ) )
+td = dom.find( "td" )
+tr = dom.find( "tr" )
+print( "%d rows, %d nodes" % ( rows, nodeCount( dom ) ) )
+
+cases = [
+    ( "td.parents()", lambda: td.parents() ),
+    ( "td.parent()", lambda: td.parent() ),
+    ( "tr.siblings()", lambda: tr.siblings() ),
+    ( "tr.nextAll()", lambda: tr.nextAll() ),
+    ( "tr.prevAll()", lambda: tr.prevAll() ),
+    ( "td.add('tr')", lambda: td.add( "tr" ) ),
+    ( "tr.children().andSelf()", lambda: tr.children().andSelf() ),
+    ( "td.contains('a')", lambda: td.contains( "a" ) ),
+    ( "tr.children()", lambda: tr.children() ),
+]
+for name, run in cases:
+    seconds = min( timeit.repeat( run, number = 1, repeat = 3 ) )
+    print( "%-26s %8.3f s %7d nodes" % ( name, seconds, run().length() ) )
@@ -0,0 +1,28 @@
+"""
+Helpers shared by the benchmark scripts. Every script benchmarks the htmldom
+package of this checkout, or the htmldom.py file given as its first argument
+( e.g. an older version, to compare before and after a change ).
+"""
+import os
+import sys
+import importlib.util
+
+def loadHtmldom( argv ):
+    if len( argv ) > 1 and argv[ 1 ].endswith( ".py" ):
+        spec = importlib.util.spec_from_file_location( "htmldomUnderTest", argv[ 1 ] )
+        module = importlib.util.module_from_spec( spec )
+        spec.loader.exec_module( module )
+        return module
+    sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+    from htmldom import htmldom
+    return htmldom
+
+def nodeCount( dom ):
+    return sum( len( nodes ) for nodes in dom.domNodes.values() )
+
+def tablePage( rows, row ):
+    """
+        Returns a page holding a table of rows copies of row, which is formatted
+        with the row number.
+    """
+    return "<html><body><table>" + "".join( row % { "i": i } for i in range( rows ) ) + "</table></body></html>"
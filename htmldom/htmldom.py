@@ -4,8 +4,32 @@ You may find this library useful for building applications like screen-scraping.
 Inspired by Jquery Library.
 """
 import re
+import sys
 import math
 import os
+import functools
+import bisect
+import itertools
+import mmap
+import codecs
+import collections
+import asyncio
+import threading
+import hashlib
+import json
+import gzip
+import zlib
+import io
+import time
+import marshal
+import gc
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent import futures
+from array import array
+from types import MappingProxyType
 
 elementName = r'<([\w\d_:]+)'
 restName = r'(?:\s+)?((?:[\w\d_:-]+\s*\=\s*[\'"](?:[^"\']+)?[\'"]?\s*;?)*)?\s*(?:/)?>'
@@ -13,12 +37,18 @@ restName = r'(?:\s+)?((?:[\w\d_:-]+\s*\=\s*[\'"](?:[^"\']+)?[\'"]?\s*;?)*)?\s*(?
 #StartTag
 startTag = re.compile( elementName + restName )
 
+#Used to find the next "<" or ">" after a start tag, see startTagSettled().
+tagBoundary = re.compile(r'[<>]')
+
 #endTag
 endTag = re.compile(r'\s*</\s*([\w\d_:]+)\s*>')
 
 
 whiteSpace = re.compile(r'\s+')
 
+#Used by the parser to skip the white space in front of the cursor.
+leadingSpace = re.compile(r'\s*')
+
 #Used to spilt attributes into name/value pair i.e. ( class="one" ==> { 'class':'one' } )
 attributeSplitter = re.compile(r'(?:([\w_\d:-]+)\s*\=\s*[\'"]([^"\']+)[\'"]\s*)')
 
@@ -40,24 +70,73 @@ newSelector = re.compile('(?:'+left + right+')?')
 #This regex is used to detect [href*=someVal] | [href^=some_val] | [href$='someVal']
 attributeSubStringSelector = re.compile(r'([~*$^])\s*\=')
 
+#Used to find the encoding declared by a <meta> tag near the start of a file.
+metaCharset = re.compile(br'<meta[^>]+charset\s*=\s*[\'"]?\s*([\w.:-]+)', re.I)
+
+#Finds the parts of a regular expression whose meaning depends on the text around a
+#match ( anchors, word boundaries and lookarounds ), see HtmlNodeList.contains().
+contextPattern = re.compile(r'\^|\$|\\[AZbB]|\(\?[=!<]')
+
+#Sent with every request made by HtmlDom.readURL().
+userAgent = 'Mozilla/9.876 (X11; U; Linux 2.2.12-20 i686, en; rv:2.0) Gecko/25250101 Netscape/5.432b1 (C-MindSpring)'
+
+#Seconds to wait for a server before a download is given up.
+fetchTimeout = 30
+
+#Statuses of the redirects followed by HtmlFetcher, and how many are followed per url.
+redirectStatuses = ( 301, 302, 303, 307, 308 )
+maximumRedirects = 10
+
+#Changed whenever the layout of HtmlDom.snapshot() changes, so old snapshots are not loaded.
+snapshotVersion = 2
+
+#Number of bytes decoded and parsed at a time by HtmlDom.fromFile().
+fileChunkSize = 1 << 20
+
+#Number of characters parsed at a time by HtmlFlatDom.createDom().
+flatChunkSize = 1 << 16
+
+#Distance between the numbers given to consecutive nodes ( see HtmlDomNode.pos ).
+positionGap = 1 << 32
+#Distance between the numbers given to inserted nodes, and the smallest distance
+#left between the nodes of a subtree which is numbered again.
+minimumGap = 1 << 8
+#The room a window of siblings needs to be spread out doubles with its size, up to
+#this many times minimumGap ( see HtmlDom.spreadSiblings() ).
+maximumSpreadLevel = 23
+
 emptyElements = [ "br", "hr", "meta", "link", 
                   "base", "link", "img", "embed",
                   "param", "area", "col", "input",
                   "basefont", "frame", "isindex" ]
 
 
+#Shared by every node which has no attributes/children yet. The real containers
+#are created by the first mutation.
+noAttributes = MappingProxyType( {} )
+noChildren = ()
+
 class HtmlDomNode:
+     """
+          Base class of the nodes. HtmlDomNode( nodeName, 1 ) creates a HtmlElementNode
+          and HtmlDomNode() or HtmlDomNode( "text" ) creates a HtmlTextNode.
+     """
+     # pos and endPos are the numbers given to a node when the document order walk
+     # enters and leaves it, so a node is an ancestor of every node whose pos lies in
+     # between. A pos of -1 means the node is not numbered ( new or removed nodes ).
+     __slots__ = ( "parentNode", "nextSiblingNode", "previousSiblingNode", "pos", "endPos" )
+
+     def __new__( cls, nodeName="text", nodeType=3 ):
+          if cls is HtmlDomNode:
+               cls = HtmlTextNode if nodeType == 3 else HtmlElementNode
+          return object.__new__( cls )
+
      def __init__( self, nodeName="text",nodeType=3):
-          self.nodeName = nodeName
-          self.nodeType = nodeType
           self.parentNode = None
           self.nextSiblingNode = None
           self.previousSiblingNode = None
-          self.children = []
-          self.attributes = {}
-          self.ancestorList = []
-          self.text = ""
           self.pos = -1
+          self.endPos = -1
 
      def setParentNode( self, parentNode ):
           self.parentNode = parentNode
@@ -69,28 +148,65 @@ class HtmlDomNode:
           self.previousSiblingNode = siblingNode
           return self
      def setChild( self, child ):
-          self.children.append( child )
+          if self.children:
+               self.children.append( child )
+          else:
+               self.children = [ child ]
+          return self
+     def addChild( self, child ):
+          """
+               Links child as the last child, like append() but without its checks and
+               without dropping cached text. Used to build a new tree.
+          """
+          children = self.children
+          if children:
+               last = children[ -1 ]
+               last.nextSiblingNode = child
+               child.previousSiblingNode = last
+               children.append( child )
+          else:
+               self.children = [ child ]
+          child.parentNode = self
           return self
      def setAttributes( self, attributeDict ):
+          if self.attributes is noAttributes:
+               self.attributes = {}
           self.attributes.update( attributeDict )
           return self
      def setAncestor( self, nodeList ):
-          self.ancestorList = list(nodeList)
+          """
+               Ancestors are derived from the parentNode chain, so there is
+               nothing to store. Kept for backward compatibility.
+          """
           return self
      def setText( self, text ):
           self.text = text
+          if self.parentNode is not None:
+               self.parentNode.clearText()
           return self
+
+     def clearText( self ):
+          """
+               Drops the text cached by getText() for the node and its ancestors,
+               must be called whenever the content of the node changes.
+          """
+          node = self
+          while node is not None:
+               node.textCache = None
+               node = node.parentNode
           
      def setAsFirstChild(self,node ):
-          self.children.insert( 0, node )
+          if self.children:
+               self.children.insert( 0, node )
+          else:
+               self.children = [ node ]
           return self
 
      def setAncestorsForChildren( self, ancestor ):
-          for childNode in self.children:
-               if not childNode.ancestorList:
-                    childNode.generateAncestorList()
-               childNode.setAncestor( childNode.ancestorList + ancestor )
-               childNode.setAncestorsForChildren( ancestor )
+          """
+               Kept for backward compatibility. Children find their ancestors
+               through the parentNode chain.
+          """
           return self
                
      def firstChild(self):
@@ -105,40 +221,59 @@ class HtmlDomNode:
           return self.previousSiblingNode
           
      def getAncestorList(self):
-          return self.ancestorList
+          return list( self.ancestors() )
+
+     #ancestorList is computed on demand, nearest parent first.
+     ancestorList = property( getAncestorList )
+
+     def ancestors( self ):
+          """
+               Generator which walks up the parentNode chain, nearest parent first.
+          """
+          parent = self.parentNode
+          while parent:
+               yield parent
+               parent = parent.parentNode
+
+     def isAncestorOf( self, node ):
+          if self.pos >= 0 and node.pos >= 0:
+               return self.pos < node.pos < self.endPos
+          return node.hasAncestor( self )
+
+     def resetPositions( self ):
+          """
+               Marks the node and its descendants as not numbered.
+          """
+          stack = [ self ]
+          while stack:
+               node = stack.pop()
+               node.pos = node.endPos = -1
+               stack.extend( node.children )
+
+     def hasAncestor( self, node ):
+          parent = self.parentNode
+          while parent:
+               if parent is node:
+                    return True
+               parent = parent.parentNode
+          return False
      def getName(self):
           return self.nodeName
      def html(self, spaces = 0 ):
-          htmlStr = " " * spaces
-          
-          htmlStr += "<" + self.nodeName
-          for attrName in self.attributes:
-               htmlStr += " " + attrName +"="+'"'+" ".join(self.attributes[attrName]) + '"'
-               
-          htmlStr += '>'
-          
-          for node in self.children:
-               if node.nodeType == 3:
-                    htmlStr += "\n" + " " * ( spaces + 4 ) + node.text.strip()
-               else:
-                    htmlStr += "\n" + node.html( spaces + 4 )
-                    
-          htmlStr += "\n" + " " * spaces + '</'+self.nodeName +'>'
-          return htmlStr
+          pieces = []
+          serializeNodes( [ self ], pieces.append, spaces )
+          return "".join( pieces )
 
      def getText(self):
-          textStr = ""
-          for node in self.children:
-               if node.nodeType == 3:
-                    textStr += node.text
-               else:
-                    textStr += node.getText() + '\n'
-          return textStr
+          text = self.textCache
+          if text is None:
+               text = self.textCache = joinText( self )
+          return text
      def getNextSiblings(self):
           siblingsSet = []
           node = self.nextSiblingNode
           while node:
-               if node not in siblingsSet and node.nodeType != 3 :
+               if node.nodeType != 3 :
                     siblingsSet.append(node)
                node = node.nextSiblingNode
           return siblingsSet
@@ -146,19 +281,21 @@ class HtmlDomNode:
           siblingsSet = []
           node = self.previousSiblingNode
           while node:
-               if node not in siblingsSet and node.nodeType != 3:
+               if node.nodeType != 3:
                     siblingsSet.append(node)
                node = node.previousSiblingNode
           return siblingsSet
      def attr( self, attrName, val = False ):
           if val:
+                if self.attributes is noAttributes:
+                     self.attributes = {}
                 self.attributes[ attrName ] = val.split()
                #return self.attributes.get( attrName, "Undefined Attribute" );
           else:
                return " ".join( self.attributes.get( attrName, ["Undefined","Attribute"] ) )
      
      def removeAttr( self, attrName ):
-        if attrName in self.attributes.keys():
+        if attrName in self.attributes:
             del self.attributes[ attrName ]
                    
      def remove( self, node ):
@@ -172,9 +309,13 @@ class HtmlDomNode:
             try:
                 pos = parent_node.children.index( node )
                 del parent_node.children[ pos ]
-                if node.previousSiblingNode and node.nextSiblingNode:
+                parent_node.clearText()
+                node.resetPositions()
+                if node.previousSiblingNode:
                     node.previousSiblingNode.nextSiblingNode = node.nextSiblingNode
+                if node.nextSiblingNode:
                     node.nextSiblingNode.previousSiblingNode = node.previousSiblingNode
+                node.previousSiblingNode = node.nextSiblingNode = None
             except ValueError:
                 raise Exception( str( node ) + ": node is not a children of the parent node" )
                 
@@ -184,6 +325,8 @@ class HtmlDomNode:
         if isinstance( node, HtmlDomNode ):
             if len( self.children ) == 0:
                 self.setChild( node )
+                self.clearText()
+                node.previousSiblingNode = node.nextSiblingNode = None
             else:
                 self.after( None, node )
             node.setParentNode( self )
@@ -193,6 +336,8 @@ class HtmlDomNode:
         if isinstance( node, HtmlDomNode ):
             if len( self.children ) == 0:
                 self.setAsFirstChild( node )
+                self.clearText()
+                node.previousSiblingNode = node.nextSiblingNode = None
             else:
                 self.before( None, node )
             node.setParentNode( self )
@@ -224,6 +369,7 @@ class HtmlDomNode:
             target.setSiblingNode( currNextSiblingNode )
             if currNextSiblingNode:
                 currNextSiblingNode.setPreviousSiblingNode( target )
+            self.clearText()
         else:
             raise Exception( "Invalid node object. object must be of type Element." )
 
@@ -256,6 +402,7 @@ class HtmlDomNode:
             target.setPreviousSiblingNode( currPrevSiblingNode )
             if currPrevSiblingNode :
                 currPrevSiblingNode.setSiblingNode( target )
+            self.clearText()
         else:
             raise Exception( "Invalid node object. object must be of type HtmlDomNode." )
      
@@ -276,456 +423,1382 @@ class HtmlDomNode:
             node.parentNode.before( node, self )
      def copy( self ):
         """
-            This function creats copy of the "self" node
+            This function creats copy of the "self" node and of its descendants.
         """
-        n = None
-        if self.nodeType == 1:
-            n = HtmlDomNode( self.nodeName, self.nodeType )
-            n.children = self.children
-            n.attributes = self.attributes
-        elif self.nodeType == 3:
-            n = HtmlDomNode()
-            n.text = self.text
-        return n
+        root = self.copyNode()
+        stack = [ ( self, root ) ]
+        while stack:
+            src, target = stack.pop()
+            for child in src.children:
+                childCopy = child.copyNode()
+                target.append( childCopy )
+                if child.children:
+                    stack.append( ( child, childCopy ) )
+        return root
         
      def generateAncestorList( self ):
-        parent = self.parentNode
-        while parent:
-            self.ancestorList.append( parent )
-            parent = parent.parentNode
+        return self.getAncestorList()
 
-class HtmlDom:
-     def __init__( self, url="" ):
-          self.baseURL = url
+class HtmlElementNode( HtmlDomNode ):
+     # textCache holds the result of getText() until the content of the node changes.
+     # rawAttributes holds the attribute text of a parsed start tag until the
+     # attributes are first read, see __getattr__.
+     __slots__ = ( "nodeName", "children", "attributes", "rawAttributes", "textCache" )
+     nodeType = 1
+     text = ""
 
-          #@var:domNodes is a dictionary which holds all the tags present in the page.
-          # So that it will be very easy to look up the tags when queried.
-          self.domNodes = {}
-          self.domNodesList = []
-          self.referenceToRootElement = None
-          self.sorted = False
-          self.xml_file = False
+     def __init__( self, nodeName, nodeType=1 ):
+          HtmlDomNode.__init__( self )
+          self.nodeName = nodeName
+          self.children = noChildren
+          self.attributes = noAttributes
+          self.rawAttributes = None
+          self.textCache = None
 
-     def createDom(self,htmlString=None):
-          if htmlString:
-               data = htmlString
-               self.parseHTML( data )
-               #self.domDictToList()               
-          else:
-               try:
-                    try:
-                         import urllib.request as urllib2
-                    except ImportError:
-                         #For python3
-                         raise Exception( "urllib module not found" )
-                    request = urllib2.Request(self.baseURL)
-                    request.add_header('User-agent','Mozilla/9.876 (X11; U; Linux 2.2.12-20 i686, en; rv:2.0) Gecko/25250101 Netscape/5.432b1 (C-MindSpring)')
-                    response = urllib2.urlopen(request)
-                    data = response.read().decode( self.getEncoding( response ) )
-                    name, extension = os.path.splitext( self.baseURL )
-                    if extension.lower().strip() == ".xml":
-                        self.xml_file = True
-                    self.parseHTML( data )
-                    #self.domDictToList()
-               except Exception as e:
-                    print("Error while reading url: %s" % (self.baseURL))
-                    #new_addition:@start
-                    raise Exception
-                    #new_addition:@end
+     def __getattr__( self, name ):
+          # only called while a slot is unset: the parser leaves attributes unset and
+          # keeps the attribute text in rawAttributes, which is parsed here on demand.
+          # The node does not know its document, so its class and id values are
+          # interned instead of going through HtmlDom.tokens.
+          if name == "attributes" and self.rawAttributes is not None:
+               self.attributes = parseAttributes( self.rawAttributes )
+               self.rawAttributes = None
+               return self.attributes
+          raise AttributeError( name )
 
-          return self
-     def parseHTML( self, data ):
+     def copyNode( self ):
+          n = HtmlElementNode( self.nodeName )
+          if self.attributes:
+               n.attributes = dict( ( attrName, list( values ) ) for attrName, values in self.attributes.items() )
+          return n
+
+class HtmlTextNode( HtmlDomNode ):
+     """
+          Text nodes have no children and no attributes, so they only carry the text.
+     """
+     __slots__ = ( "text", )
+     nodeName = "text"
+     nodeType = 3
+     children = noChildren
+     attributes = noAttributes
+     rawAttributes = None
+     textCache = ""
+
+     def __init__( self, nodeName="text", nodeType=3 ):
+          HtmlDomNode.__init__( self )
+          self.text = ""
+
+     def copyNode( self ):
+          n = HtmlTextNode()
+          n.text = self.text
+          return n
+
+class SelectorStep:
+     """
+          One compound selector ( e.g. "div.one[href]" ) of a compiled css selector.
+          @var:combinators holds the "+"/">" combinators which precede it.
+     """
+     def __init__( self, combinators, elemName, resetContext, classSelector, idSelector, attrList ):
+          self.combinators = combinators
+          self.elemName = elemName
+          self.resetContext = resetContext
+          self.classSelector = classSelector
+          self.idSelector = idSelector
+          self.attrList = attrList
+
+class CompiledSelector:
+     """
+          A css selector which is parsed once and can be run against any HtmlDom.
+          Use compileSelector() to get a cached instance.
+     """
+     def __init__( self, selectors ):
+          self.selector = selectors
+          self.steps = tuple( self.parse( selectors ) )
+          self.relationCache = {}
+          # the selection restarts from the whole document at a "*" token which is the first token.
+          self.start = 0
+          for index in range( len( self.steps ) - 1, -1, -1 ):
+               if self.steps[ index ].resetContext:
+                    self.start = index
+                    break
+
+     def __repr__( self ):
+          return "CompiledSelector(%r)" % self.selector
+
+     def relations( self, hasContext ):
+          """
+               Returns the combinator which relates every step to the step in front of it
+               ( " " for descendant, ">" or "+" ) or None for the first step when there
+               is no context. A "+"/">" which has nothing on its left hand side is carried
+               over to the next step.
+          """
+          if hasContext not in self.relationCache:
+               pending = { '+': False, '>': False }
+               relations = []
+               for index, step in enumerate( self.steps ):
+                    for value in step.combinators:
+                         pending[ value ] = True
+                    if index == 0 and ( step.resetContext or not hasContext ):
+                         relations.append( None )
+                    elif step.resetContext:
+                         relations.append( None )
+                    elif pending[ '+' ]:
+                         pending[ '+' ] = False
+                         relations.append( '+' )
+                    elif pending[ '>' ]:
+                         pending[ '>' ] = False
+                         relations.append( '>' )
+                    else:
+                         relations.append( ' ' )
+               self.relationCache[ hasContext ] = tuple( relations )
+          return self.relationCache[ hasContext ]
+
+     def parse( self, selectors ):
+          combinators = []
+          _index = -1
+          # the following line is required for handling following kinds of inputs
+          # "div+a" getConverted into "div + a". Now it is easy to split on spaces.
+          selectors = re.sub(r'([+>])',r' \1 ',selectors)
+          
+          #normalizing the inputs.
+          selectors = whiteSpace.sub( ' ', selectors )
+          
+          selectors = selectors.split()
+          
+          for value in selectors:
+               _index += 1
+               if value == '+' or value == '>':
+                    combinators.append( value )
+                    continue
+               classSelector = []
+               idSelector = []
+               attr_list = []
+               match = selector.search( value )
+               elemName = match.group(1)
+               data = match.group(2)
+               invalid = 0
+               while data and invalid != 100:
+                    invalid += 1
+                    match = newSelector.search( data )
+                    if match:
+                         data = match.group(2)                
+                         #class selector
+                         if match.group(1).find(".") == 0:
+                              classSelector.append( match.group(1)[1:] )
+                         #id selector
+                         elif match.group(1).find("#") == 0:
+                              idSelector.append( match.group(1)[1:] )
+                         # attribute selector
+                         elif match.group(1).find("[") == 0:
+                              attributeSelectorFlags = {
+                                                         '$':False,'^':False,'*':False,'noVal':False,"~":False
+                                                       }
+                              attr = match.group(1)[1:][:-1]
+                              attrMatch = attributeSubStringSelector.search( attr )
+                              if attrMatch:
+                                   attributeSelectorFlags[attrMatch.group(1)] = True
+                                   _index = attr.find(attrMatch.group(1))
+                                   attr = attr[:_index - len(attr)] + attr[_index + 1:]
+                                   attr = attr.split("=")
+                              elif attr.find("=") == -1:
+                                   #Only attribute name is given not the value.
+                                   attributeSelectorFlags['noVal'] = True
+                                   attr = attr.split()
+                                   attr.append('')
+                              else:
+                                   attr = attr.split("=")
+                              #new addition
+                              attr[1] = re.sub(r'[\'\"]?','',attr[1])
+                              if attr[ 1 ] == '':
+                                   attributeSelectorFlags[ "noVal" ] = True
+                              attr_list.append( ( { attr[0]: attr[1] }, attributeSelectorFlags ) )
+               if invalid == 100:
+                   raise Exception( "Invalid regular expression" )
+               if not ( elemName or classSelector or idSelector or attr_list ):
+                    #nothing to select on, the token is ignored.
+                    continue
+               # "*" as the very first token selects from the whole document.
+               resetContext = elemName == "*" and _index == 0
+               # the parser interns node names, so they compare by identity.
+               if elemName:
+                    elemName = sys.intern( elemName )
+               yield SelectorStep( tuple( combinators ), elemName, resetContext,
+                                   tuple( classSelector ), tuple( idSelector ), tuple( attr_list ) )
+               combinators = []
+
+class HtmlDomParser:
+     """
+          Builds the nodes of a HtmlDom from html text which may arrive in chunks.
+          Only the tags, comments and texts which are known to end inside the
+          buffered text are parsed, the rest waits for the next chunk or close().
+     """
+     def __init__( self, dom, data = "" ):
+          self.dom = dom
+          self.data = data
+          #"cursor" points at the first unparsed character of data.
+          self.cursor = 0
           # pos is used in order to preserve their logical order of nodes in the document
           # because i am using dictionary datastructure to store the nodes so while retriving
           # nodes their orders will be different. In order to avoid that i sort the set on
           # "pos" variable[ sort_function:time sort ]
-          pos = 1
-          index = 0
-          doc_seen = False
-          comment_string = "<!--"
+          # Closing a node also takes a number ( endPos ), see HtmlDomNode. Numbers are
+          # positionGap apart, so that inserted nodes can be numbered in between.
+          self.pos = positionGap
+          self.docSeen = False
           #Node stack will hold the parent Nodes. The top most node will be the current parent.
-          nodeStack = []
-          while data:
-              # to remove new lines.
-               data = data.strip()
-               #Doctype tag
-               if not doc_seen and ( data.find("<!DOCTYPE") == 0 or data.find("<!doctype") == 0 or data.find( "<?xml" ) == 0 ):
-                    #Just pass through the doctype tag.
-                    index = data.find(">")
-                    data = data[ index + 1:]
-                    doc_seen = True
-                    continue
-               #Comment Node
-               #if data.find("<!--") == 0:
-               #pointer = 0
-               for i in range( 0, 4 ):
-                 if data[ i ] != comment_string[ i ]:
-                   break
+          self.nodeStack = []
+          #True when the text in front of the tag at the cursor has been parsed already.
+          self.afterText = False
+          #Optional callbacks. startNode is called with every element once it has been
+          #added to the tree and endNode once the element is complete ( see iterFind ).
+          self.startNode = None
+          self.endNode = None
+          #Every element of a tag shares one nodeName string, @var:tagNames maps the
+          #names as written to these interned strings.
+          self.tagNames = {}
+
+     def feed( self, chunk ):
+          # the open elements are the only ones the chunk can change.
+          if self.nodeStack:
+               self.nodeStack[ -1 ].clearText()
+          if self.cursor:
+               self.data = self.data[ self.cursor: ]
+               self.cursor = 0
+          self.data += chunk
+          self.parse( False )
+
+     def close( self ):
+          if self.nodeStack:
+               self.nodeStack[ -1 ].clearText()
+          self.parse( True )
+          #close the nodes which were left open.
+          while self.nodeStack:
+               node = self.nodeStack.pop()
+               node.endPos = self.pos
+               self.pos += positionGap
+               if self.endNode is not None:
+                    self.endNode( node )
+          self.data = ""
+          self.cursor = 0
+
+     def parse( self, final ):
+          """
+               Parses the buffered text. Unless final is set, parsing stops in front of
+               the first token whose end ( or whose meaning ) depends on text which has
+               not been fed yet.
+          """
+          dom = self.dom
+          data = self.data
+          cursor = self.cursor
+          pos = self.pos
+          docSeen = self.docSeen
+          nodeStack = self.nodeStack
+          afterText = self.afterText
+          startNode = self.startNode
+          endNode = self.endNode
+          tagNames = self.tagNames
+          #The document is never sliced. "end" excludes the trailing white space of the
+          #document, which is only known once the last chunk has been fed.
+          end = len( data.rstrip() ) if final else len( data )
+          while cursor < end:
+               if afterText:
+                    index = data.find( "<", cursor, end )
                else:
-                    #Just pass through the comment node.
-                    index = data.find("-->")
-                    data = data[index + 3:]
-                    continue
+                    # to skip new lines.
+                    cursor = leadingSpace.match( data, cursor ).end()
+                    #the longest prefix looked at below is "<!DOCTYPE".
+                    if not final and end - cursor < 9:
+                         break
+                    #Doctype tag
+                    if not docSeen and ( data.startswith( "<!DOCTYPE", cursor ) or data.startswith( "<!doctype", cursor ) or data.startswith( "<?xml", cursor ) ):
+                         #Just pass through the doctype tag.
+                         index = data.find( ">", cursor, end )
+                         if index != -1:
+                              cursor = index + 1
+                         elif not final:
+                              break
+                         docSeen = True
+                         continue
+                    #Comment Node
+                    if data.startswith( "<!--", cursor ):
+                         #Just pass through the comment node.
+                         index = data.find( "-->", cursor, end )
+                         if index == -1 and not final:
+                              break
+                         cursor = index + 3 if index != -1 else cursor + 2
+                         continue
 
-               #index is just used for extracting texts within the tags.
-               #could change in future.
-               index = data.find("<")
+                    #index is just used for extracting texts within the tags.
+                    #could change in future.
+                    index = data.find( "<", cursor, end )
 
-               # len(nodeStack) >= 1 means found text content between the end of a tag and the start of a new tag
-               if len( nodeStack ) >= 1:
-                    _index = -1
-                    #if "script" element is on the top of the stack then entire content of it will be stored in a single text node
-                    if nodeStack[-1].getName() == "script":
-                         _index = data.find( "</script>" )
-                         if _index != -1:
-                              tmpData = data[ :_index ]
-                    #if "style" element is on the top of the stack then entire content of it will be stored in a single text node
-                    elif nodeStack[-1].getName() == "style":
-                         _index = data.find("</style>")
-                         if _index != -1:
-                              tmpData = data[:_index]
-                    else:
-                         tmpData = data[:index]
-                         
-                    #tmpData should not be empty.
-                    if tmpData:
-                         textNode = HtmlDomNode("text")
-                         textNode.setText(tmpData)
-                         
-                         textNode.pos = pos
-                         pos += 1
-                         
-                         if len(nodeStack) > 0:
-                              nodeStack[ -1 ].append( textNode )
-                              textNode.setAncestor( nodeStack[::-1] )
-                              self.domNodesList.append( textNode )
-                              self.registerNode( textNode.nodeName, textNode )
+                    # len(nodeStack) >= 1 means found text content between the end of a tag and the start of a new tag
+                    if len( nodeStack ) >= 1:
+                         _index = -1
+                         rawText = False
+                         #if "script" element is on the top of the stack then entire content of it will be stored in a single text node
+                         if nodeStack[-1].getName() == "script":
+                              _index = data.find( "</script>", cursor, end )
+                              rawText = True
+                         #if "style" element is on the top of the stack then entire content of it will be stored in a single text node
+                         elif nodeStack[-1].getName() == "style":
+                              _index = data.find( "</style>", cursor, end )
+                              rawText = True
+
+                         if _index == -1 and not final and ( rawText or index == -1 ):
+                              #the end of the text has not been fed yet.
+                              break
                          if _index != -1:
-                              data = data[_index:].strip()
+                              textEnd = _index
+                         elif index != -1:
+                              textEnd = index
                          else:
-                              data = data[index:].strip()
-                              
-                    else:
-                         data = data.strip()
+                              #No more tags: the last character is left for the top level text node.
+                              textEnd = end - 1
+
+                         #text should not be empty.
+                         if textEnd > cursor:
+                              textNode = HtmlDomNode("text")
+                              textNode.setText( data[ cursor:textEnd ] )
+
+                              textNode.pos = textNode.endPos = pos
+                              pos += positionGap
+
+                              nodeStack[ -1 ].addChild( textNode )
+                              dom.domNodesList.append( textNode )
+                              dom.registerNode( textNode.nodeName, textNode )
+                              cursor = leadingSpace.match( data, textEnd ).end()
+                              index = data.find( "<", cursor, end )
+                              afterText = True
+
+               #Nothing below changes the tree before it is known to be complete, so
+               #parsing can stop and restart at tokenStart.
+               tokenStart = cursor
+               if not final and end - cursor < 2:
+                    break
                #end of a tag
-               if data.find("</") == 0:
-                    match = endTag.search( data )
-                    data = data[len(match.group()):].strip()
-                    try:
-                         nodeStack.pop()
+               if data.startswith( "</", cursor ):
+                    #An unanchored search is kept as a fallback so that malformed tags
+                    #are consumed exactly the way they always have been.
+                    match = endTag.match( data, cursor, end )
+                    if not match:
+                         if not final and data.find( ">", cursor, end ) == -1:
+                              break
+                         match = endTag.search( data, cursor, end )
+                         if not match and not final:
+                              break
+                    tagStart = cursor
+                    if match:
+                         cursor += len( match.group() )
+                    else:
+                         cursor = end
+                    cursor = leadingSpace.match( data, cursor ).end()
+                    if nodeStack:
+                         afterText = False
+                         node = nodeStack.pop()
+                         node.endPos = pos
+                         pos += positionGap
+                         if endNode is not None:
+                              endNode( node )
                          continue
-                    except IndexError:
-                         nodeStack = []
+                    if not final and end - cursor < 1:
+                         cursor = tokenStart
+                         break
+                    if index != -1:
+                         index += cursor - tagStart
 
                #start of a tag.
-               if data.find("<") == 0:
-                    match = startTag.search( data )
+               if data.startswith( "<", cursor ):
+                    #see the end tag handling above for the unanchored fallback.
+                    match = startTag.match( data, cursor, end )
+                    if not final and not startTagSettled( data, cursor, match ):
+                         cursor = tokenStart
+                         break
                     if not match:
-                         #Fail silently
+                         match = startTag.search( data, cursor, end )
+                         if not final and not ( match and startTagSearchSettled( data, cursor, match ) ):
+                              cursor = tokenStart
+                              break
+                    afterText = False
+                    if not match:
+                         #Fail silently: skip the malformed tag.
+                         index = data.find( ">", cursor, end )
+                         cursor = index + 1 if index != -1 else end
                          continue
-                         
+
                     #match.group(1) will contain the element name
                     elementName = match.group(1)
                     #new addition:  added lower function to the element name.
-                    domNode = HtmlDomNode( elementName.lower(), 1 )
-                    domNode.pos = pos
-                    pos += 1
+                    nodeName = tagNames.get( elementName )
+                    if nodeName is None:
+                         nodeName = tagNames[ elementName ] = sys.intern( elementName.lower() )
+                    domNode = HtmlDomNode( nodeName, 1 )
+                    #endPos is set again when a pushed node is popped.
+                    domNode.pos = domNode.endPos = pos
+                    pos += positionGap
                     attr = match.group(2)
                     if attr:
-                         #converting multispaces into single space.for easy handling of attributes
-                         attr = whiteSpace.sub( ' ', attr.strip() )
-                         attr = attributeSplitter.findall( attr )
-                         attrDict = {}
-                         for attrName,attrValues in attr:
-                              attrDict[attrName] = attrValues.split()
-
-                         domNode.setAttributes( attrDict )
+                         #the attributes are parsed when they are first needed.
+                         del domNode.attributes
+                         domNode.rawAttributes = attr
                     if len(nodeStack) > 0:
                          # nodeStack[ -1 ] is a HtmlDomNode object
-                         nodeStack[ -1 ].append( domNode )
-                         #setting ancestor list
-                         domNode.setAncestor( nodeStack[::-1] )
+                         nodeStack[ -1 ].addChild( domNode )
                          #push the current node into the stack.so now domNode becomes the current parent node.
                          #if the current node is an empty element,do not push the element into the stack.
-                         if not self.xml_file:
+                         if not dom.xml_file:
                              if elementName not in emptyElements:
                                   nodeStack.append( domNode )
                          elif match.group().find( "/>" ) == -1:
                              nodeStack.append( domNode )
                     else:
-                         domNode.setAncestor( nodeStack )
                          # nodeStack is a list
-                         nodeStack.append( domNode )                         
-                         self.referenceToRootElement = domNode
+                         nodeStack.append( domNode )
+                         dom.referenceToRootElement = domNode
+                         dom.topLevelNodes.append( domNode )
 
-                    self.registerNode( domNode.nodeName, domNode )
-                    data = data[len(match.group()):].strip()
+                    dom.registerNode( domNode.nodeName, domNode )
+                    cursor += len( match.group() )
+                    if startNode is not None:
+                         startNode( domNode )
+                         #an element which is not pushed has no content.
+                         if nodeStack[ -1 ] is not domNode:
+                              endNode( domNode )
                else:
+                    if index == -1 and not final:
+                         cursor = tokenStart
+                         break
+                    afterText = False
+                    #A top level text node is never inside the open nodes.
+                    while nodeStack:
+                         node = nodeStack.pop()
+                         node.endPos = pos
+                         pos += positionGap
+                         if endNode is not None:
+                              endNode( node )
                     domNode = HtmlDomNode( "text" )
-                    domNode.pos = pos
-                    pos += 1
+                    domNode.pos = domNode.endPos = pos
+                    pos += positionGap
                     if index == -1:
-                        domNode.setText( data )
-                        data = data[ len( data ): ].strip()
+                        domNode.setText( data[ cursor:end ] )
+                        cursor = end
                     else:
-                        domNode.setText( data[ :index ] )
-                        data = data[ index: ]
-                    self.registerNode( domNode.nodeName, domNode ) 
-                    self.domNodesList.append( domNode )
+                        domNode.setText( data[ cursor:index ] )
+                        cursor = index
+                    dom.registerNode( domNode.nodeName, domNode )
+                    dom.domNodesList.append( domNode )
+                    dom.topLevelNodes.append( domNode )
+
+          self.cursor = cursor
+          self.pos = pos
+          self.docSeen = docSeen
+          self.afterText = afterText
+
+class HtmlFetcher:
+     """
+          Downloads pages over persistent http/https connections, one per host in each
+          thread, and asks for gzip/deflate compressed bodies. With a cacheDir, bodies
+          which come with an ETag or a Last-Modified header are kept there and asked for
+          again with a conditional request, so a 304 answer reuses the stored body.
+          Other schemes and urls which go through a proxy are left to urllib.
+     """
+     def __init__( self, cacheDir = None, timeout = None ):
+          self.cacheDir = cacheDir
+          self.timeout = timeout
+          if cacheDir:
+               os.makedirs( cacheDir, exist_ok = True )
+          #@var:local holds the connections of each thread by ( scheme, host ).
+          self.local = threading.local()
+
+     def read( self, url, timeout = None ):
+          """
+               Returns the body of url as bytes and its content type. Statuses other
+               than 2xx, 304 and redirects raise urllib.error.HTTPError.
+          """
+          timeout = timeout or self.timeout or fetchTimeout
+          for redirect in range( maximumRedirects + 1 ):
+               parts = urllib.parse.urlsplit( url )
+               if parts.scheme not in ( "http", "https" ) or urllib.request.getproxies().get( parts.scheme ):
+                    request = urllib.request.Request( url )
+                    request.add_header( 'User-agent', userAgent )
+                    with urllib.request.urlopen( request, timeout = timeout ) as response:
+                         return response.read(), response.headers.get( 'Content-Type' )
+               headers = { 'User-Agent': userAgent, 'Accept-Encoding': 'gzip, deflate' }
+               cached = self.cached( url )
+               if cached:
+                    meta, body = cached
+                    if meta.get( 'etag' ):
+                         headers[ 'If-None-Match' ] = meta[ 'etag' ]
+                    if meta.get( 'lastModified' ):
+                         headers[ 'If-Modified-Since' ] = meta[ 'lastModified' ]
+               status, reason, responseHeaders, body = self.request( parts, headers, timeout )
+               if status in redirectStatuses and responseHeaders.get( 'Location' ):
+                    url = urllib.parse.urljoin( url, responseHeaders[ 'Location' ] )
+                    continue
+               break
+          else:
+               raise urllib.error.HTTPError( url, status, "Too many redirects", responseHeaders, None )
+          if status == 304 and cached:
+               meta, body = cached
+               return body, meta.get( 'contentType' )
+          if not 200 <= status < 300:
+               raise urllib.error.HTTPError( url, status, reason, responseHeaders, io.BytesIO( body ) )
+          body = decodeBody( body, responseHeaders.get( 'Content-Encoding' ) )
+          etag = responseHeaders.get( 'ETag' )
+          lastModified = responseHeaders.get( 'Last-Modified' )
+          if self.cacheDir and ( etag or lastModified ):
+               self.store( url, body, { 'url': url, 'etag': etag, 'lastModified': lastModified,
+                                        'contentType': responseHeaders.get( 'Content-Type' ) } )
+          return body, responseHeaders.get( 'Content-Type' )
+
+     def request( self, parts, headers, timeout ):
+          """
+               Sends a GET for the url parts over the connection of the current thread
+               to their host and returns the status, reason, headers and raw body.
+          """
+          connections = self.local.__dict__.setdefault( 'connections', {} )
+          key = ( parts.scheme, parts.netloc )
+          path = parts.path or "/"
+          if parts.query:
+               path += "?" + parts.query
+          while True:
+               connection = connections.get( key )
+               fresh = connection is None
+               if fresh:
+                    if parts.scheme == "https":
+                         connection = http.client.HTTPSConnection( parts.netloc, timeout = timeout )
+                    else:
+                         connection = http.client.HTTPConnection( parts.netloc, timeout = timeout )
+                    connections[ key ] = connection
+               else:
+                    connection.timeout = timeout
+                    if connection.sock:
+                         connection.sock.settimeout( timeout )
+               try:
+                    connection.request( "GET", path, headers = headers )
+                    response = connection.getresponse()
+                    body = response.read()
+               except ( http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError ):
+                    connection.close()
+                    del connections[ key ]
+                    # the server may have closed a connection which was kept open, the
+                    # request is sent once more over a new one.
+                    if fresh:
+                         raise
+                    continue
+               except BaseException:
+                    connection.close()
+                    del connections[ key ]
+                    raise
+               return response.status, response.reason, response.headers, body
+
+     def cachePath( self, url ):
+          return os.path.join( self.cacheDir, hashlib.sha1( url.encode( 'utf-8' ) ).hexdigest() )
+
+     def cached( self, url ):
+          """
+               Returns the stored ( meta, body ) of url or None.
+          """
+          if not self.cacheDir:
+               return None
+          try:
+               with open( self.cachePath( url ), 'rb' ) as f:
+                    meta = json.loads( f.readline().decode( 'utf-8' ) )
+                    body = f.read()
+          except ( OSError, ValueError ):
+               return None
+          if meta.get( 'url' ) != url:
+               return None
+          return meta, body
+
+     def store( self, url, body, meta ):
+          # the entry is a line of json followed by the body, written to a temporary
+          # file first so that readers never see half of it.
+          path = self.cachePath( url )
+          temp = "%s.%d.%d.tmp" % ( path, os.getpid(), threading.get_ident() )
+          with open( temp, 'wb' ) as f:
+               f.write( json.dumps( meta ).encode( 'utf-8' ) + b"\n" )
+               f.write( body )
+          os.replace( temp, path )
+
+#Used by HtmlDom.readURL() when no fetcher is given.
+defaultFetcher = HtmlFetcher()
+
+class HtmlSnapshotCache:
+     """
+          Keeps HtmlDom.snapshot()s of parsed documents in a directory, keyed by a hash
+          of the document. When the files take more than maxSize bytes, the least
+          recently used ones are removed ( the size is checked each time an eighth
+          of maxSize has been written ). Several processes can share the directory:
+          files are written under a temporary name and renamed into place, and a
+          file removed by another process is a cache miss.
+     """
+     def __init__( self, directory, maxSize = 1 << 30 ):
+          self.directory = directory
+          self.maxSize = maxSize
+          os.makedirs( directory, exist_ok = True )
+          #@var:written counts the bytes saved since the size of the directory was checked.
+          self.written = maxSize
+
+     def key( self, data, xmlFile = False ):
+          digest = hashlib.sha256( data.encode( 'utf-8', 'surrogatepass' ) )
+          digest.update( b"%d %d" % ( snapshotVersion, xmlFile ) )
+          return digest.hexdigest()
+
+     def path( self, key ):
+          return os.path.join( self.directory, key + ".snapshot" )
+
+     def load( self, key, dom ):
+          """
+               Loads the snapshot stored under key into the empty dom, returns False
+               if there is none.
+          """
+          path = self.path( key )
+          try:
+               with open( path, 'rb' ) as f:
+                    data = f.read()
+               dom.loadSnapshot( data )
+          except ( OSError, ValueError, EOFError, TypeError, zlib.error ):
+               return False
+          try:
+               # the modification time orders the files for the eviction.
+               os.utime( path )
+          except OSError:
+               pass
+          return True
+
+     def save( self, key, dom ):
+          data = dom.snapshot()
+          path = self.path( key )
+          temp = "%s.%d.%d.tmp" % ( path, os.getpid(), threading.get_ident() )
+          with open( temp, 'wb' ) as f:
+               f.write( data )
+          os.replace( temp, path )
+          self.written += len( data )
+          if self.written > self.maxSize // 8:
+               self.evict()
+
+     def evict( self ):
+          """
+               Removes the least recently used snapshots until the directory holds at
+               most maxSize bytes of them.
+          """
+          self.written = 0
+          entries = []
+          total = 0
+          now = time.time()
+          for entry in os.scandir( self.directory ):
+               try:
+                    stat = entry.stat()
+                    if entry.name.endswith( ".tmp" ):
+                         # left behind by a writer which did not finish.
+                         if stat.st_mtime < now - 3600:
+                              os.remove( entry.path )
+                         continue
+               except FileNotFoundError:
+                    continue
+               if entry.name.endswith( ".snapshot" ):
+                    entries.append( ( stat.st_mtime, stat.st_size, entry.path ) )
+                    total += stat.st_size
+          entries.sort()
+          for mtime, size, path in entries:
+               if total <= self.maxSize:
+                    break
+               try:
+                    os.remove( path )
+               except FileNotFoundError:
+                    pass
+               total -= size
+
+#Used by the new HtmlDom objects to look up the documents they parse, see HtmlSnapshotCache.
+snapshotCache = None
+
+class HtmlDom:
+     def __init__( self, url="" ):
+          self.baseURL = url
+
+          #@var:domNodes is a dictionary which holds all the tags present in the page.
+          # So that it will be very easy to look up the tags when queried.
+          # It maps a tag name to an insertion ordered { node: None } dict.
+          self.domNodes = {}
+          #@var:classIndex and @var:idIndex map every class/id value of the registered
+          # nodes to a { node: None } dict, so class and id selectors need not scan domNodes.
+          self.classIndex = {}
+          self.idIndex = {}
+          #@var:attributeIndex maps an attribute name to the registered nodes which carry it.
+          self.attributeIndex = {}
+          #@var:unindexed holds the registered nodes whose attributes have not been parsed
+          # yet as a { node: None } dict, indexAttributes() adds them to the indexes above.
+          self.unindexed = {}
+          #@var:indexedKeys holds the ( attribute, value ) keys for which the indexes hold
+          # all the nodes, including those in unindexed.
+          self.indexedKeys = {}
+          #@var:tokens maps the class and id values of the document to their first copy.
+          self.tokens = {}
+          self.domNodesList = []
+          self.referenceToRootElement = None
+          #@var:topLevelNodes holds the nodes without a parent in document order.
+          self.topLevelNodes = []
+          self.sorted = False
+          self.xml_file = False
+          #@var:parser holds the state of a parse started by feed() until close().
+          self.parser = None
+          #@var:textRanges caches the result of getTextRanges().
+          self.textRanges = None
+          #@var:snapshots is the HtmlSnapshotCache used by parseHTML().
+          self.snapshots = snapshotCache
+
+     def createDom(self,htmlString=None):
+          if htmlString:
+               data = htmlString
+               self.parseHTML( data )
+               #self.domDictToList()               
+          else:
+               try:
+                    data = self.readURL()
+                    self.parseHTML( data )
+                    #self.domDictToList()
+               except Exception as e:
+                    print("Error while reading url: %s" % (self.baseURL))
+                    #new_addition:@start
+                    raise Exception( "Error while reading url: %s" % self.baseURL ) from e
+                    #new_addition:@end
+
+          return self
+
+     def readURL( self, timeout = None, fetcher = None ):
+          """
+               Downloads baseURL with fetcher ( defaultFetcher if None ) and returns its
+               text. Errors of the download are raised as they are, a server which does
+               not answer within timeout seconds ( fetchTimeout by default ) raises
+               socket.timeout.
+          """
+          data, contentType = ( fetcher or defaultFetcher ).read( self.baseURL, timeout )
+          data = data.decode( contentCharset( contentType ) )
+          name, extension = os.path.splitext( self.baseURL )
+          if extension.lower().strip() == ".xml":
+              self.xml_file = True
+          return data
+
+     @classmethod
+     async def fetch( cls, url, timeout = None, executor = None, fetcher = None ):
+          """
+               Coroutine which downloads url with fetcher ( see readURL ) and returns its
+               dom. The download and the parsing run in executor ( the default executor
+               of the loop if None ), so the event loop is not blocked by either of them.
+          """
+          loop = asyncio.get_running_loop()
+          dom = cls( url )
+          data = await loop.run_in_executor( executor, dom.readURL, timeout, fetcher )
+          await loop.run_in_executor( executor, dom.parseHTML, data )
+          return dom
+
+     @classmethod
+     def fromFile( cls, path, encoding=None ):
+          """
+               Returns the dom of the html file at path. The file is memory mapped and
+               decoded a chunk at a time while it is parsed, so the text of the whole
+               file is never held in memory besides the tree. Without an encoding, the
+               byte order mark or the <meta> charset of the file is used, else utf-8.
+          """
+          dom = cls( path )
+          name, extension = os.path.splitext( path )
+          if extension.lower().strip() == ".xml":
+               dom.xml_file = True
+          with open( path, 'rb' ) as f:
+               if os.fstat( f.fileno() ).st_size == 0:
+                    # empty files can not be mapped.
+                    return dom.close()
+               with mmap.mmap( f.fileno(), 0, access=mmap.ACCESS_READ ) as data:
+                    if encoding is None:
+                         encoding = sniffEncoding( data[ :1024 ] )
+                    # archived pages often carry a few invalid bytes, which should not
+                    # stop the rest of the page from being parsed.
+                    decoder = codecs.getincrementaldecoder( encoding )( 'replace' )
+                    for start in range( 0, len( data ), fileChunkSize ):
+                         dom.feed( decoder.decode( data[ start:start + fileChunkSize ] ) )
+                    dom.feed( decoder.decode( b'', True ) )
+          return dom.close()
+
+     def parseHTML( self, data ):
+          snapshots = self.snapshots
+          if snapshots is None or self.topLevelNodes:
+               HtmlDomParser( self, data ).close()
+               return
+          key = snapshots.key( data, self.xml_file )
+          if not snapshots.load( key, self ):
+               HtmlDomParser( self, data ).close()
+               snapshots.save( key, self )
+
+     def snapshot( self ):
+          """
+               Returns the document ( nodes, positions and lookup indexes ) as bytes,
+               which loadSnapshot() turns back into the same document.
+          """
+          # nodes are stored in document order, as parallel lists, and refered to by
+          # their index.
+          nodes = []
+          for root in self.topLevelNodes:
+               stack = [ root ]
+               while stack:
+                    node = stack.pop()
+                    nodes.append( node )
+                    if node.children:
+                         stack.extend( reversed( node.children ) )
+          indexes = dict( zip( nodes, range( len( nodes ) ) ) )
+          parents = [ indexes.get( node.parentNode, -1 ) for node in nodes ]
+          names = [ None if node.nodeType == 3 else node.nodeName for node in nodes ]
+          # attributes which have not been parsed yet are stored as their text.
+          values = [ node.text if node.nodeType == 3 else
+                     node.rawAttributes if node.rawAttributes is not None else node.attributes or None
+                     for node in nodes ]
+          positions = [ node.pos for node in nodes ]
+          endPositions = [ node.endPos for node in nodes ]
+          def indexLists( registry ):
+               return dict( ( name, [ indexes[ node ] for node in nodes if node in indexes ] )
+                            for name, nodes in registry.items() )
+          root = indexes.get( self.referenceToRootElement, -1 )
+          return zlib.compress( marshal.dumps( ( snapshotVersion, self.xml_file, self.sorted,
+                                                 parents, names, values, positions, endPositions,
+                                                 [ indexes[ node ] for node in self.topLevelNodes ], root,
+                                                 [ indexes[ node ] for node in self.domNodesList if node in indexes ],
+                                                 indexLists( self.domNodes ), indexLists( self.classIndex ),
+                                                 indexLists( self.idIndex ), indexLists( self.attributeIndex ),
+                                                 [ indexes[ node ] for node in self.unindexed if node in indexes ] ) ), 1 )
+
+     def loadSnapshot( self, data ):
+          """
+               Makes this empty dom the document saved by snapshot().
+          """
+          # nothing created here is garbage, so the collector would only walk the new
+          # objects over and over.
+          gcEnabled = gc.isenabled()
+          gc.disable()
+          try:
+               self.loadNodes( data )
+          finally:
+               if gcEnabled:
+                    gc.enable()
+          return self
+
+     def loadNodes( self, data ):
+          snapshot = marshal.loads( zlib.decompress( data ) )
+          if snapshot[ 0 ] != snapshotVersion:
+               raise ValueError( "snapshot version %r is not supported" % ( snapshot[ 0 ], ) )
+          ( version, self.xml_file, self.sorted, parents, names, values, positions, endPositions,
+            topLevel, root, domNodesList, domNodes, classIndex, idIndex, attributeIndex, unindexed ) = snapshot
+          # the nodes are set up here rather than by their __init__, which is the slow
+          # part of loading.
+          newNode = object.__new__
+          nodes = []
+          for name, value, pos, endPos, parent in zip( names, values, positions, endPositions, parents ):
+               if name is None:
+                    node = newNode( HtmlTextNode )
+                    node.text = value
+               else:
+                    node = newNode( HtmlElementNode )
+                    node.nodeName = name
+                    node.children = noChildren
+                    if isinstance( value, str ):
+                         # left unset, see HtmlElementNode.__getattr__.
+                         node.rawAttributes = value
+                    else:
+                         node.attributes = value or noAttributes
+                         node.rawAttributes = None
+                    node.textCache = None
+               node.pos = pos
+               node.endPos = endPos
+               node.nextSiblingNode = None
+               # parents come before their children, so every child list is built in order.
+               if parent >= 0:
+                    parentNode = nodes[ parent ]
+                    node.parentNode = parentNode
+                    children = parentNode.children
+                    if children:
+                         last = children[ -1 ]
+                         last.nextSiblingNode = node
+                         node.previousSiblingNode = last
+                         children.append( node )
+                    else:
+                         node.previousSiblingNode = None
+                         parentNode.children = [ node ]
+               else:
+                    node.parentNode = None
+                    node.previousSiblingNode = None
+               nodes.append( node )
+          def registry( indexLists ):
+               return dict( ( name, dict.fromkeys( map( nodes.__getitem__, indexList ) ) )
+                            for name, indexList in indexLists.items() )
+          self.domNodes = registry( domNodes )
+          self.classIndex = registry( classIndex )
+          self.idIndex = registry( idIndex )
+          self.attributeIndex = registry( attributeIndex )
+          self.unindexed = dict.fromkeys( map( nodes.__getitem__, unindexed ) )
+          self.indexedKeys = {}
+          self.domNodesList = list( map( nodes.__getitem__, domNodesList ) )
+          self.topLevelNodes = list( map( nodes.__getitem__, topLevel ) )
+          self.referenceToRootElement = nodes[ root ] if root >= 0 else None
+
+     def feed( self, chunk ):
+          """
+               Parses the next chunk of the document. The chunks can be split anywhere,
+               the tree is the same as the one createDom() builds from the whole text.
+               Call close() after the last chunk.
+          """
+          if self.parser is None:
+               self.parser = HtmlDomParser( self )
+          self.parser.feed( chunk )
+          return self
+
+     def close( self ):
+          """
+               Parses the rest of the fed data and closes the nodes which are still open.
+          """
+          if self.parser is not None:
+               self.parser.close()
+               self.parser = None
+          return self
 
      def registerNode( self, nodeName, domNode ):
-          if self.domNodes.get(nodeName,None):
-               #self.domNodes[nodeName].append( domNode )
-               if domNode not in self.domNodes[ nodeName ]:
-                    self.domNodes[nodeName].append( domNode )               
-#               self.domNodes[ nodeName ] += self.getUniqueNodes( self.domNodes[ nodeName ], [ domNode ] )
+          # Each entry of domNodes is an insertion ordered dict used as an identity set,
+          # so registering an already registered node is a no-op.
+          nodes = self.domNodes.get( nodeName )
+          if nodes is None:
+               self.domNodes[ nodeName ] = { domNode: None }
           else:
-               self.domNodes[ nodeName ] = [domNode]
+               nodes[ domNode ] = None
+          if domNode.rawAttributes is not None:
+               self.unindexed[ domNode ] = None
+               if self.indexedKeys:
+                    self.indexedKeys.clear()
+          elif domNode.attributes:
+               self.indexNode( domNode )
+
+     def isRegistered( self, domNode ):
+          return domNode in self.domNodes.get( domNode.nodeName, () )
+
+     def indexNode( self, domNode ):
+          """
+               Adds the attribute names and the class/id values of a registered node
+               to the lookup indexes.
+          """
+          for attrName in domNode.attributes:
+               self.attributeIndex.setdefault( attrName, {} )[ domNode ] = None
+          for value in domNode.attributes.get( "class", () ):
+               self.classIndex.setdefault( value, {} )[ domNode ] = None
+          for value in domNode.attributes.get( "id", () ):
+               self.idIndex.setdefault( value, {} )[ domNode ] = None
+
+     def indexAttributes( self, attrName, value = None ):
+          """
+               Parses and indexes the nodes in unindexed which may carry the attribute
+               attrName, or the class/id value when given. Called before the indexes are
+               used for them. Nodes whose attribute text does not contain the name ( or
+               the value ) cannot match and are left unparsed.
+          """
+          key = ( attrName, value )
+          unindexed = self.unindexed
+          if not unindexed or key in self.indexedKeys:
+               return
+          text = attrName if value is None else value
+          # rawAttributes is None for the nodes which were parsed when they were first read.
+          candidates = [ domNode for domNode in unindexed
+                         if domNode.rawAttributes is None or text in domNode.rawAttributes ]
+          tokens = self.tokens
+          domNodes = self.domNodes
+          # as in loadSnapshot(), the collector would only walk the new objects.
+          gcEnabled = gc.isenabled()
+          gc.disable()
+          try:
+               for domNode in candidates:
+                    del unindexed[ domNode ]
+                    if domNode.rawAttributes is not None:
+                         domNode.attributes = parseAttributes( domNode.rawAttributes, tokens )
+                         domNode.rawAttributes = None
+                    # the node may have been removed since it was registered.
+                    if domNode.attributes and domNode in domNodes.get( domNode.nodeName, () ):
+                         self.indexNode( domNode )
+          finally:
+               if gcEnabled:
+                    gc.enable()
+          self.indexedKeys[ key ] = None
+
+     def unindexNode( self, domNode ):
+          for attrName in domNode.attributes:
+               nodes = self.attributeIndex.get( attrName )
+               if nodes:
+                    nodes.pop( domNode, None )
+          for value in domNode.attributes.get( "class", () ):
+               nodes = self.classIndex.get( value )
+               if nodes:
+                    nodes.pop( domNode, None )
+          for value in domNode.attributes.get( "id", () ):
+               nodes = self.idIndex.get( value )
+               if nodes:
+                    nodes.pop( domNode, None )
                
      def updateDomNodes( self, newDomNodes ):
           for nodeName in newDomNodes:
-               self.domNodes[nodeName] += newDomNodes[nodeName]
+               for domNode in newDomNodes[nodeName]:
+                    self.registerNode( nodeName, domNode )
      def removeFromDomDict( self, node ):   
-        if self.domNodes.get( node.nodeName, None ):
-            try:
-                pos = self.domNodes[ node.nodeName ].index( node )
-                del self.domNodes[ node.nodeName ][ pos ]
-            except ValueError:
-                pass
+        nodes = self.domNodes.get( node.nodeName )
+        if nodes and node in nodes:
+            del nodes[ node ]
+            self.unindexed.pop( node, None )
+            self.unindexNode( node )
         
+     def setNodeAttr( self, node, attrName, val ):
+          """
+               Sets an attribute of the node and keeps the lookup indexes in sync.
+          """
+          registered = self.isRegistered( node )
+          if registered:
+               self.unindexNode( node )
+          node.attr( attrName, val )
+          if registered:
+               self.indexNode( node )
+
+     def removeNodeAttr( self, node, attrName ):
+          registered = self.isRegistered( node )
+          if registered:
+               self.unindexNode( node )
+          node.removeAttr( attrName )
+          if registered:
+               self.indexNode( node )
+
+     def renumber( self ):
+          """
+               Numbers all the nodes of the document again ( see HtmlDomNode.pos ).
+          """
+          pos = 0
+          for node in self.topLevelNodes:
+               pos = modifyPositions( node, pos + positionGap, positionGap )
+
+     def getTextRanges( self ):
+          """
+               Returns the text of the whole document and a dict mapping every element
+               in it to the ( start, end ) of its getText() within that text. The result
+               is kept until the text of the document changes.
+          """
+          # a change to the text drops the cached text of the top level element above it.
+          if self.textRanges is not None:
+               text, ranges, roots = self.textRanges
+               if len( roots ) == len( self.topLevelNodes ) and \
+                  all( root is node and root.textCache is rootText for ( root, rootText ), node in zip( roots, self.topLevelNodes ) ):
+                    return text, ranges
+          pieces = []
+          length = 0
+          ranges = {}
+          for root in self.topLevelNodes:
+               if root.nodeType == 3:
+                    continue
+               stack = [ ( root, length, iter( root.children ) ) ]
+               while stack:
+                    node, start, children = stack[ -1 ]
+                    for child in children:
+                         if child.nodeType == 3:
+                              pieces.append( child.text )
+                              length += len( child.text )
+                         else:
+                              stack.append( ( child, length, iter( child.children ) ) )
+                              break
+                    else:
+                         stack.pop()
+                         ranges[ node ] = ( start, length )
+                         pieces.append( '\n' )
+                         length += 1
+          text = "".join( pieces )
+          for root in self.topLevelNodes:
+               if root.textCache is None:
+                    start, end = ranges[ root ]
+                    root.textCache = text[ start:end ]
+          self.textRanges = ( text, ranges, [ ( root, root.textCache ) for root in self.topLevelNodes ] )
+          return text, ranges
+
+     def placeNode( self, node ):
+          """
+               Numbers a node which has just been inserted into the document, and its
+               descendants, using the free numbers between its neighbours. If there are
+               not enough of them, a window of siblings around the node is spread out
+               again ( see spreadSiblings() ), and the whole document as a last resort.
+          """
+          parent = node.parentNode
+          if parent:
+               prevNode = node.previousSiblingNode
+               nextNode = node.nextSiblingNode
+               lower = prevNode.endPos if prevNode else parent.pos
+               upper = nextNode.pos if nextNode else parent.endPos
+               needed = positionsNeeded( node )
+               step = ( upper - lower ) // ( needed + 1 )
+               if lower >= 0 and upper >= 0 and step >= 1:
+                    # new nodes are numbered close together and next to the side where
+                    # further nodes are likely to be added ( append, prepend ), or in
+                    # the middle of the free numbers.
+                    step = min( step, minimumGap )
+                    if not nextNode:
+                         pos = lower + step
+                    elif not prevNode:
+                         pos = upper - needed * step
+                    else:
+                         pos = lower + ( upper - lower - ( needed - 1 ) * step ) // 2
+                    modifyPositions( node, pos, step )
+                    return
+               if self.spreadSiblings( node, { node: needed } ):
+                    return
+          window = node
+          while window.parentNode:
+               window = window.parentNode
+          if window in self.topLevelNodes:
+               self.renumber()
+          else:
+               # node has been inserted into a tree which is not part of the document.
+               node.resetPositions()
+
+     def spreadSiblings( self, node, sizes ):
+          """
+               Numbers again the siblings around a node whose neighbours have no free
+               numbers left between them. The window of siblings doubles until its
+               numbers can be spread out at least minimumGap << level apart, and moves
+               on to the siblings of the parent once it holds all the children.
+               Larger windows need more room to spare, so that a window is spread out
+               again only after about as many inserts as it holds nodes ( this is the
+               usual list labeling scheme ). sizes caches positionsNeeded() of nodes.
+               Returns False if the whole document has to be renumbered.
+          """
+          level = 1
+          window = node
+          while window.parentNode:
+               parent = window.parentNode
+               siblings = parent.children
+               index = siblings.index( window )
+               radius = 1
+               while True:
+                    first = max( index - radius, 0 )
+                    last = min( index + radius, len( siblings ) - 1 )
+                    lower = siblings[ first - 1 ].endPos if first else parent.pos
+                    upper = siblings[ last + 1 ].pos if last + 1 < len( siblings ) else parent.endPos
+                    if lower < 0 or upper < 0:
+                         return False
+                    needed = 0
+                    for sibling in siblings[ first:last + 1 ]:
+                         if sibling not in sizes:
+                              sizes[ sibling ] = positionsNeeded( sibling )
+                         needed += sizes[ sibling ]
+                    threshold = minimumGap << min( level, maximumSpreadLevel )
+                    step = ( upper - lower ) // ( needed + 1 )
+                    if step >= threshold:
+                         step = min( step, max( threshold, positionGap ) )
+                         pos = lower
+                         for sibling in siblings[ first:last + 1 ]:
+                              pos = modifyPositions( sibling, pos + step, step )
+                         return True
+                    level += 1
+                    if first == 0 and last == len( siblings ) - 1:
+                         break
+                    radius *= 2
+               sizes[ parent ] = needed + 2
+               window = parent
+          return False
+
      def getDomDict(self):
-          return self.domNodes
+          """
+               Returns a dictionary which maps every tag name to the list of nodes
+               registered under it, in document order.
+          """
+          domDict = {}
+          for nodeName in self.domNodes:
+               domDict[ nodeName ] = sorted( self.domNodes[ nodeName ], key = lambda x: x.pos )
+          return domDict
 
      def domDictToList(self, no_text_node = True ):
           n = []
           for nodeName in self.domNodes:
-               for selectedNode in self.domNodes[nodeName]:
-                    #Converting the dictionary into a list of values.
-                    self.domNodesList.append( selectedNode )
-                    if not no_text_node:
-                        if selectedNode.nodeType == 1:
-                            n.append( selectedNode )
-          
-          self.domNodesList = list( set( self.domNodesList ) )
-          if not self.sorted:
-              self.domNodesList = sorted( self.domNodesList, key = lambda x: x.pos )
-              self.sorted = True
-          if not no_text_node:
-                return sorted( n, key = lambda x: x.pos )
-          return self.domNodesList
-                    
-     #new edition nList=[]
-     #this addition is for find function for HtmlNodeList
-     def find(self,selectors,nList=[]):
-          classSelector = []
-          idSelector = []
-          attributeSelector = {}
-          attributeSelectorFlags = {
-                                     '$':False,'^':False,'*':False,'noVal':False,"~":False
-                                   }
-          selectorMethod = {'+':False,'>':False}
-          attr_list = []
-          #new edition
-          nodeList = nList
-          _index = -1
-          # the following line is required for handling following kinds of inputs
-          # "div+a" getConverted into "div + a". Now it is easy to split on spaces.
-          selectors = re.sub(r'([+>])',r' \1 ',selectors)
-          
-          #normalizing the inputs.
-          selectors = whiteSpace.sub( ' ', selectors )
-          
-          selectors = selectors.split()
-          
-          data = ""
-          elemName = ""
-          for value in selectors:
-               _index += 1
-               if value == '+' or value == '>':
-                    selectorMethod[value] = True
-                    continue
-               match = selector.search( value )
-               if match:
-                    elemName = match.group(1)
-                    data = match.group(2)
-                    invalid = 0
-                    while data and invalid != 100:
-                         invalid += 1
-                         match = newSelector.search( data )
-                         if match:
-                              data = match.group(2)                
-                              #class selector
-                              if match.group(1).find(".") == 0:
-                                   index = match.group(1).find(".")
-                                   classSelector.append( match.group(1)[index+1:] )
-                              #id selector
-                              elif match.group(1).find("#") == 0:
-                                   index = match.group(1).find("#")
-                                   idSelector.append( match.group(1)[index +1:] )
-                              # attribute selector
-                              elif match.group(1).find("[") == 0:
-                                   index = match.group(1).find("]")
-                                   attr = match.group(1)[1:][:-1]
-                                   attrMatch = re.search( attributeSubStringSelector, attr )
-                                   if attrMatch:
-                                        attributeSelectorFlags[attrMatch.group(1)] = True
-                                        _index = attr.find(attrMatch.group(1))
-                                        attr = attr[:_index - len(attr)] + attr[_index + 1:]
-                                        attr = attr.split("=")
-                                   elif attr.find("=") == -1:
-                                        #Only attribute name is given not the value.
-                                        attributeSelectorFlags['noVal'] = True
-                                        attr = attr.split()
-                                        attr.append('')
-                                   else:
-                                        attr = attr.split("=")
-                                   #new addition
-                                   attr[1] = re.sub(r'[\'\"]?','',attr[1])
-                                   #new addition
-                                   attributeSelector[attr[0]] = attr[1]
-                                   if attr[ 1 ] == '':
-                                        attributeSelectorFlags[ "noVal" ] = True
-                                   attr_list.append( ( dict( attributeSelector ), dict( attributeSelectorFlags ) ) )
-                                   attributeSelector = {}
-                                   attributeSelectorFlags = {
-                                                                    '$':False,'^':False,'*':False,'noVal':False,"~":False
-                                                            }
-                    if invalid == 100:
-                        raise Exception( "Invalid regular expression" )
-                    else:
-                        invalid = 0
-                    if elemName:
-                         if elemName == "*" and _index == 0:
-                            nodes = self.domDictToList( no_text_node = False )
-                            nodeList = []
-                         elif elemName == "*":
-                            nodes = self.domDictToList( no_text_node = False )
-                         else:
-                             nodes = self.domNodes.get( elemName, [] )
-                    else:
-                         if classSelector:
-                              nodes = self.getNodesWithClassOrId(classSelector[-1],selectType='class')
-                         elif idSelector:
-                              nodes = self.getNodesWithClassOrId(idSelector[-1],selectType='id')
-                         elif attr_list:
-                              nodes = []
-                              #new Addition:Mon 13 Feb
-                              for a_s, a_f in attr_list:
-                                  nodes += self.getNodesWithAttributes( a_s, a_f )
-                              nodes = list( set( nodes ) )
-                              
-                    tmpList = []
-                    method = ''
-                    for node in nodeList:
-                         if selectorMethod['+']:
-                              method = '+'
-                              for selectedNode in nodes:
-                                   if node.nextSiblingNode == selectedNode:
-                                        tmpList.append( selectedNode )
-                              tmpList = list( set( tmpList ) )
-                         elif selectorMethod['>']:
-                              method = '>'
-                              for selectedNode in nodes:
-                                   if selectedNode in node.children:
-                                        tmpList.append( selectedNode )
-                              tmpList = list( set( tmpList ) )
-                         else:
-                              for selectedNode in nodes:
-                                   if not selectedNode.ancestorList:
-                                        selectedNode.generateAncestorList()
-                                   if node in selectedNode.ancestorList:
-                                        tmpList.append( selectedNode )
-                              tmpList = list( set( tmpList ) )
-                    if method != '':
-                        selectorMethod[ method ] = False
-                        method = ''
-                    if not nodeList:
-                         tmpList = nodes
-                    nodes = tmpList
-                    nodeList = []
-                    for node in nodes:
-                         nodeAccepted = True
-                         for value in classSelector:
-                              if value not in node.attributes.get('class',[]):
-                                   nodeAccepted = False
-                                   break
-                         if nodeAccepted:
-                              for value in idSelector:
-                                   if value not in node.attributes.get('id',[]):
-                                        nodeAccepted = False
-                                        break
-                         if nodeAccepted:
-                              for a_s, a_f in attr_list:
-                                   nodeAccepted = self.getNodesWithAttributes( a_s, a_f, [node] )
-                                   if not nodeAccepted:
-                                        break
-                         if nodeAccepted:
-                              nodeList.append(node)
-                    classSelector = []
-                    idSelector = []
-                    attributeSelector = {}
-                    attributeSelectorFlags = {'$':False,'^':False,'*':False,'noVal':False}
-                    attr_list = []
-               if not nodeList:
-                    break
+               for selectedNode in self.domNodes[nodeName]:
+                    #Converting the dictionary into a list of values.
+                    self.domNodesList.append( selectedNode )
+                    if not no_text_node:
+                        if selectedNode.nodeType == 1:
+                            n.append( selectedNode )
           
-          nodeList = sorted( nodeList, key = lambda x : x.pos )
+          self.domNodesList = list( set( self.domNodesList ) )
+          if not self.sorted:
+              self.domNodesList = sorted( self.domNodesList, key = lambda x: x.pos )
+              self.sorted = True
+          if not no_text_node:
+                return sorted( n, key = lambda x: x.pos )
+          return self.domNodesList
+                    
+     #new edition nList=[]
+     #this addition is for find function for HtmlNodeList
+     def find(self,selectors,nList=[]):
+          """
+               selectors is either a css selector string or a CompiledSelector.
+               Selector strings are compiled once and cached by compileSelector().
+               nList is the optional context: only the nodes related to them are selected.
+               The matching itself is done by selectNodes().
+          """
+          nodeList = sorted( selectNodes( self, selectors, nList ), key = lambda x : x.pos )
           return HtmlNodeList( nodeList, self )
+
+     def matches( self, node, selectors, memo = None ):
+          """
+               Checks whether find( selectors ) would select the node, by matching the
+               selector against the node and its ancestors/siblings only.
+               memo can be shared by calls made while the document does not change.
+          """
+          return selectorMatches( self, node, selectors, memo )
+
+     # the accessors used by selectNodes() and selectorMatches().
+     def parentOf( self, node ):
+          return node.parentNode
+
+     def previousSiblingOf( self, node ):
+          prevNode = node.previousSiblingNode
+          if prevNode is not None and prevNode.nextSiblingNode is node:
+               return prevNode
+          return None
+
+     def descendantTest( self, ancestors ):
+          return descendantTest( ancestors )
+
+     def elementNodes( self ):
+          return self.domDictToList( no_text_node = False )
+
+     def nodesNamed( self, nodeName ):
+          return self.domNodes.get( nodeName, {} )
+
+     def matchesStep( self, node, step ):
+          """
+               Checks whether the node is selected by a single compound selector.
+          """
+          elemName = step.elemName
+          if elemName == "*":
+               if node.nodeType != 1:
+                    return False
+          elif elemName and node.nodeName != elemName:
+               return False
+          return self.isRegistered( node ) and self.acceptsNode( node, step )
+
+     def acceptsNode( self, node, step ):
+          """
+               Checks the class, id and attribute parts of a compound selector.
+          """
+          return stepAccepts( step, node.attributes.get )
+
      def getNodesWithClassOrId( self,className="",nodeList = None,selectType=""):
-          tmpList = []
-          for nodeName in self.domNodes:
-               [ tmpList.append( selectedNode ) for selectedNode in self.domNodes[nodeName] if className in selectedNode.attributes.get(selectType,['']) ]
-          return tmpList
+          self.indexAttributes( selectType, className )
+          if selectType == "class":
+               index = self.classIndex
+          else:
+               index = self.idIndex
+          # The check guards against attributes which were changed behind the index's back.
+          return [ selectedNode for selectedNode in index.get( className, () ) if className in selectedNode.attributes.get(selectType,['']) ]
      def getNodesWithAttributes( self, attributeSelector,attributeSelectorFlags,nodeList = None):
-          if not self.sorted:
-              self.domDictToList()
-          tmpList = self.domNodesList
-          
+          key,attrValue = list(attributeSelector.items())[0]
           if nodeList:
                tmpList = nodeList
-          key,attrValue = list(attributeSelector.items())[0]
-          newList = []
-          for node in tmpList:
-               nodeAccepted = True
-               if attributeSelectorFlags['$']:
-                    #if attributeSelector[key] not in node.attributes.get(key,[''])[-1][len(node.attributes.get(key,[''])[-1])::-1]:
-                    if attributeSelector[key] != node.attributes.get(key,[''])[-1]:
-                         nodeAccepted = False
-               elif attributeSelectorFlags['^']:
-                    if attributeSelector[key] not in node.attributes.get(key,[''])[0]:
-                         nodeAccepted = False
-               elif attributeSelectorFlags['*']:
-                    if attributeSelector[key] not in " ".join(node.attributes.get(key,[])):
-                         nodeAccepted = False
-               elif attributeSelectorFlags['noVal']:
-                    if key not in node.attributes:
-                         nodeAccepted = False
-               elif attributeSelectorFlags[ "~" ]:
-                    if attributeSelector[key] not in node.attributes.get( key, [] ):
-                        nodeAccepted = False
-               elif attributeSelector[key] != " ".join(node.attributes.get(key,[])):
-                    nodeAccepted = False
-               if nodeAccepted:
-                    newList.append(node)
-          return newList
+          elif attrValue or not ( attributeSelectorFlags['$'] or attributeSelectorFlags['^'] or attributeSelectorFlags['*'] ):
+               # Only the nodes which carry the attribute can match.
+               self.indexAttributes( key )
+               tmpList = self.attributeIndex.get( key, () )
+          else:
+               # [attr^=''] and friends also match nodes without the attribute.
+               if not self.sorted:
+                   self.domDictToList()
+               tmpList = self.domNodesList
+          return [ node for node in tmpList if attributeAccepts( node.attributes.get( key ), attrValue, attributeSelectorFlags ) ]
      def getUniqueNodes(self,srcList, newList ):
-          tmpList = []
-          for selectedNode in newList:
-               if selectedNode not in srcList:
-                    tmpList.append( selectedNode  )
-          return tmpList
+          srcSet = set( srcList )
+          return [ selectedNode for selectedNode in newList if selectedNode not in srcSet ]
      def getEncoding( self, response ):
-          encoding = 'utf-8'
-          for key,val in response.headers.items():
-               if key == 'Content-Type':
-                    encoding = val.split(";")
-                    try:
-                         encoding = encoding[1].split('=')[1].strip()
-                    except IndexError:
-                         encoding = 'utf-8'
-                         break
-                    break
-          return encoding                    
+          return contentCharset( response.headers.get( 'Content-Type' ) )
+
+class HtmlNodeStream:
+     """
+          Runs a selector over a document while it is being parsed ( see iterFind ).
+          Only the open elements, the last few children of each of them and the
+          content of the selected elements which are still open are kept.
+     """
+     def __init__( self, selector ):
+          if not isinstance( selector, CompiledSelector ):
+               selector = compileSelector( selector )
+          self.selector = selector
+          self.dom = HtmlDom()
+          self.parser = HtmlDomParser( self.dom )
+          self.parser.startNode = self.startNode
+          self.parser.endNode = self.endNode
+          # "a + b + c" looks two siblings back from c, so every open element keeps that
+          # many children besides the one being parsed.
+          siblings = longest = 0
+          for relation in selector.relations( False ):
+               siblings = siblings + 1 if relation == '+' else 0
+               longest = max( longest, siblings )
+          self.keepChildren = longest + 1
+          #@var:selected holds the open elements which are selected.
+          self.selected = {}
+          self.memo = {}
+          self.results = []
+
+     def feed( self, chunk ):
+          """
+               Parses the chunk and returns the selected elements which have been
+               completed by it.
+          """
+          self.parser.feed( chunk )
+          return self.flush()
+
+     def close( self ):
+          self.parser.close()
+          return self.flush()
+
+     def flush( self ):
+          results = self.results
+          self.results = []
+          # these are only needed to run queries against a whole document.
+          del self.dom.domNodesList[:]
+          del self.dom.topLevelNodes[:]
+          self.dom.unindexed.clear()
+          self.memo.clear()
+          return results
+
+     def startNode( self, node ):
+          if self.dom.matches( node, self.selector, self.memo ):
+               self.selected[ node ] = None
+
+     def endNode( self, node ):
+          dom = self.dom
+          parent = node.parentNode
+          if node in self.selected:
+               del self.selected[ node ]
+               if self.selected or self.keepChildren > 1:
+                    # a selected ancestor or a following sibling still needs the node.
+                    self.results.append( subtreeNodeList( node.copy() ) )
+               else:
+                    if parent:
+                         parent.remove( node )
+                         node.parentNode = None
+                    stack = [ node ]
+                    while stack:
+                         child = stack.pop()
+                         dom.removeFromDomDict( child )
+                         stack.extend( child.children )
+                    self.results.append( subtreeNodeList( node ) )
+                    return
+          # a selected ancestor still needs the content of the node.
+          if self.selected:
+               return
+          stack = list( node.children )
+          while stack:
+               child = stack.pop()
+               dom.removeFromDomDict( child )
+               stack.extend( child.children )
+          node.children = noChildren
+          if parent and len( parent.children ) > self.keepChildren:
+               for child in parent.children[ :-self.keepChildren ]:
+                    dom.removeFromDomDict( child )
+               parent.children = parent.children[ -self.keepChildren: ]
+               parent.children[ 0 ].previousSiblingNode = None
 
 class HtmlNodeList:
      def __init__( self, nodeList,dom,prevNodeList=[],prevObject = None):
@@ -769,6 +1842,7 @@ class HtmlNodeList:
               for node in self.nodeList:
                    [ childrenList.append(child) for child in node.children ]
           
+          childrenList = uniqueNodes( childrenList )
           if selector:
                return HtmlNodeList( childrenList, self.htmlDom, self.nodeList, self ).filter( selector )
           else:
@@ -777,33 +1851,28 @@ class HtmlNodeList:
           
      def html( self, data = None ):
           if not data:
-              htmlStr = ""
-              for node in self.nodeList:
-                   htmlStr += node.html()
-              return htmlStr
+              pieces = []
+              serializeNodes( self.nodeList, pieces.append )
+              return "".join( pieces )
           else:
               for node in self.nodeList:
-                for child_node in node.children:
+                for child_node in list( node.children ):
                     node.remove( child_node )
                     self.htmlDom.removeFromDomDict( child_node )
-                    del child_node
-                node.children = []
               self.append( data )
               return self
                
      def text( self, data = None ):
           if not data:
-              textStr = ""
-              for node in self.nodeList:
-                   textStr += node.getText()
-              return textStr
+              # inner nodes go first, so that outer nodes reuse their cached text.
+              for node in sorted( self.nodeList, key = lambda x: x.pos, reverse = True ):
+                   node.getText()
+              return "".join( [ node.getText() for node in self.nodeList ] )
           else:
               for node in self.nodeList:
-                for child_node in node.children:
+                for child_node in list( node.children ):
                     node.remove( child_node )
                     self.htmlDom.removeFromDomDict( child_node )
-                    del child_node
-                node.children = []
               self.append( data )
               return self
      
@@ -812,36 +1881,35 @@ class HtmlNodeList:
                return self.nodeList[0].attr( attrName, val )
           elif val:
                for node in self.nodeList:
-                    node.attr( attrName, val )
+                    self.htmlDom.setNodeAttr( node, attrName, val )
                return self
           else:
                raise IndexError
      
      def removeAttr( self, attrName ):
         for node in self.nodeList:
-            node.removeAttr( attrName )
+            self.htmlDom.removeNodeAttr( node, attrName )
         return self
 
      def filter(self,selector):
-          nList = self.htmlDom.find( selector )
+          memo = {}
           tmpList = []
           for node in self.nodeList:
-               if node in nList.nodeList:
-                    tmpList += self.getUniqueNodes( tmpList, [node] )
+               if self.htmlDom.matches( node, selector, memo ):
+                    tmpList.append( node )
                     
-          tmpList = sorted( tmpList, key = lambda x : x.pos )
+          tmpList = sorted( uniqueNodes( tmpList ), key = lambda x : x.pos )
 
           return HtmlNodeList( tmpList,self.htmlDom, self.nodeList,self)
           
      def _not(self,selector ):
-          nList = self.htmlDom.find( selector )
+          memo = {}
           tmpList = []
           for node in self.nodeList:
-               if node not in nList.nodeList:
+               if not self.htmlDom.matches( node, selector, memo ):
                     tmpList.append( node )
                     
-          tmpList = list( set( tmpList ) )
-          tmpList = sorted( tmpList, key = lambda x : x.pos )
+          tmpList = sorted( uniqueNodes( tmpList ), key = lambda x : x.pos )
           return HtmlNodeList( tmpList,self.htmlDom, self.nodeList, self )
           
      def eq(self,index ):
@@ -858,23 +1926,30 @@ class HtmlNodeList:
           
      def has(self,selector ):
           nList = self.htmlDom.find( selector )
+          # nList is sorted on pos, so the first numbered node after node.pos
+          # tells whether node contains any of them.
+          positions = [ selectedNode.pos for selectedNode in nList.nodeList if selectedNode.pos >= 0 ]
+          unnumbered = [ selectedNode for selectedNode in nList.nodeList if selectedNode.pos < 0 ]
           tmpList = []
           for node in self.nodeList:
-               for selectedNode in nList.nodeList:
-                    if not selectedNode.ancestorList:
-                        node.generateAncestorList()
-                    if node in selectedNode.ancestorList:
-                        tmpList += self.getUniqueNodes( tmpList, [ node ] )
+               found = False
+               if node.pos >= 0:
+                    index = bisect.bisect_right( positions, node.pos )
+                    found = index < len( positions ) and positions[ index ] < node.endPos
+               if not found:
+                    found = any( selectedNode.hasAncestor( node ) for selectedNode in unnumbered )
+               if found:
+                    tmpList.append( node )
           
-          tmpList = sorted( tmpList, key = lambda x: x.pos )
+          tmpList = sorted( uniqueNodes( tmpList ), key = lambda x: x.pos )
           return HtmlNodeList( tmpList,self.htmlDom, self.nodeList,self)
           
      def _is(self,selector):
-          val = self.filter( selector )
-          if val.nodeList:
-               return True
-          else:
-               return False
+          memo = {}
+          for node in self.nodeList:
+               if self.htmlDom.matches( node, selector, memo ):
+                    return True
+          return False
                
      def next(self, selector = None):
           tmpList = []
@@ -884,8 +1959,9 @@ class HtmlNodeList:
                while nextNode and nextNode.nodeType == 3:
                     nextNode = nextNode.nextSiblingNode
                if nextNode:
-                    tmpList += self.getUniqueNodes( tmpList, [ nextNode ] )
+                    tmpList.append( nextNode )
           
+          tmpList = uniqueNodes( tmpList )
           if selector:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self ).filter( selector )
           else:
@@ -894,8 +1970,15 @@ class HtmlNodeList:
      
      def nextAll(self, selector = None ):
           tmpList = []
+          seen = set()
           for node in self.nodeList:
-               tmpList += self.getUniqueNodes( tmpList, node.getNextSiblings() )
+               nextNode = node.nextSiblingNode
+               # the siblings after a seen sibling have been collected already.
+               while nextNode and nextNode not in seen:
+                    seen.add( nextNode )
+                    if nextNode.nodeType != 3:
+                         tmpList.append( nextNode )
+                    nextNode = nextNode.nextSiblingNode
                
           if selector:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self ).filter( selector )
@@ -904,24 +1987,19 @@ class HtmlNodeList:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self)
      
      def nextUntil(self,selector):
-          nList = self.htmlDom.find(selector)
+          memo = {}
           siblingsSet = []
           tmpList = []
-          selectedNodeList = []
           for node in self.nodeList:
                #This function gets all the siblings.
                tmpList = node.getNextSiblings()
-               for selectedNode in nList.nodeList:
-                    try:
-                         index = tmpList.index( selectedNode )
-                         selectedNodeList = tmpList[:index]
-                         siblingsSet += self.getUniqueNodes( siblingsSet, selectedNodeList )
+               #the nearest matching sibling decides where to stop.
+               for index, selectedNode in enumerate( tmpList ):
+                    if self.htmlDom.matches( selectedNode, selector, memo ):
+                         tmpList = tmpList[:index]
                          break
-                    except ValueError:
-                         pass
-               else:
-                    siblingsSet += self.getUniqueNodes( siblingsSet, tmpList )
-          siblingsSet = sorted( siblingsSet, key = lambda x: x.pos )                    
+               siblingsSet += tmpList
+          siblingsSet = sorted( uniqueNodes( siblingsSet ), key = lambda x: x.pos )                    
           return HtmlNodeList( siblingsSet,self.htmlDom, self.nodeList, self)
      
      def prev(self, selector = None ):
@@ -932,8 +2010,9 @@ class HtmlNodeList:
                while prevNode and prevNode.nodeType == 3: # if its text node: loop
                     prevNode = prevNode.previousSiblingNode
                if prevNode:
-                    tmpList += self.getUniqueNodes( tmpList, [ prevNode ] )
+                    tmpList.append( prevNode )
                
+          tmpList = uniqueNodes( tmpList )
           if selector:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self ).filter( selector )
           else:
@@ -942,8 +2021,15 @@ class HtmlNodeList:
      
      def prevAll( self, selector = None ):
           tmpList = []
+          seen = set()
           for node in self.nodeList:
-               tmpList += self.getUniqueNodes( tmpList, node.getPreviousSiblings() )
+               prevNode = node.previousSiblingNode
+               # the siblings before a seen sibling have been collected already.
+               while prevNode and prevNode not in seen:
+                    seen.add( prevNode )
+                    if prevNode.nodeType != 3:
+                         tmpList.append( prevNode )
+                    prevNode = prevNode.previousSiblingNode
           if selector:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self ).filter( selector )
           else:
@@ -951,25 +2037,22 @@ class HtmlNodeList:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self)
      
      def prevUntil(self,selector):
-          nList = self.htmlDom.find(selector)
+          memo = {}
           siblingsSet = []
           tmpList = []
-          selectedNodeList = []
           for node in self.nodeList:
                #This function gets all the previous siblings.
                tmpList = node.getPreviousSiblings()
-               for selectedNode in nList.nodeList:
-                    try:
-                         index = tmpList.index( selectedNode )
-                         selectedNodeList = tmpList[:index]
-                         siblingsSet += self.getUniqueNodes( siblingsSet, selectedNodeList )
-                         break
-                    except ValueError:
-                         pass
-               else:
-                    siblingsSet += self.getUniqueNodes( siblingsSet, tmpList )
+               #the matching sibling which comes first in the document decides where to stop.
+               index = -1
+               for selectedIndex, selectedNode in enumerate( tmpList ):
+                    if self.htmlDom.matches( selectedNode, selector, memo ):
+                         index = selectedIndex
+               if index != -1:
+                    tmpList = tmpList[:index]
+               siblingsSet += tmpList
                     
-          siblingsSet = sorted( siblingsSet, key = lambda x: x.pos )
+          siblingsSet = sorted( uniqueNodes( siblingsSet ), key = lambda x: x.pos )
           return HtmlNodeList( siblingsSet,self.htmlDom, self.nodeList, self )
      
      def siblings(self,selector=None):
@@ -977,14 +2060,21 @@ class HtmlNodeList:
              This function gets all the siblings of each node present in the current 
              HtmlNodeList object.( including previous and next siblings )
           """
-          prevSiblingsSet = []
-          nextSiblingsSet = []
+          # The children of every parent are visited once: when more than one of
+          # them is in the current set, each of them is a sibling of another one.
+          selectedChildren = {}
           siblingsSet = []
           for node in self.nodeList:
-               prevSiblingsSet = node.getPreviousSiblings()
-               siblingsSet += self.getUniqueNodes( siblingsSet, prevSiblingsSet )
-               nextSiblingsSet = node.getNextSiblings()
-               siblingsSet += self.getUniqueNodes( siblingsSet, nextSiblingsSet )
+               if node.parentNode:
+                    selectedChildren.setdefault( node.parentNode, {} )[ node ] = None
+               else:
+                    siblingsSet += node.getPreviousSiblings()
+                    siblingsSet += node.getNextSiblings()
+          for parent, selected in selectedChildren.items():
+               for child in parent.children:
+                    if child.nodeType != 3 and ( len( selected ) > 1 or child not in selected ):
+                         siblingsSet.append( child )
+          siblingsSet = uniqueNodes( siblingsSet )
           if selector:
                return HtmlNodeList( siblingsSet, self.htmlDom, self.nodeList, self ).filter( selector )
           else:
@@ -1000,7 +2090,8 @@ class HtmlNodeList:
           tmpList = []
           for node in self.nodeList:
                if node.parentNode:
-                    tmpList += self.getUniqueNodes( tmpList, [ node.parentNode ] )
+                    tmpList.append( node.parentNode )
+          tmpList = uniqueNodes( tmpList )
           if selector:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self ).filter( selector )
           else:
@@ -1014,10 +2105,14 @@ class HtmlNodeList:
                selector: It is used to filter the parent list means to select only specific parents.
           """     
           tmpList = []
+          seen = set()
           for node in self.nodeList:
-               if not node.ancestorList:
-                    node.generateAncestorList()
-               tmpList += self.getUniqueNodes( tmpList, node.ancestorList )
+               for parent in node.ancestors():
+                    # the ancestors of a seen node have been collected already.
+                    if parent in seen:
+                         break
+                    seen.add( parent )
+                    tmpList.append( parent )
           if selector:
                return HtmlNodeList( tmpList, self.htmlDom, self.nodeList, self ).filter( selector )
           else:
@@ -1030,25 +2125,20 @@ class HtmlNodeList:
                of each node present in the current HtmlNodeList object until the parent specified by the 
                selector is reached.
           """
-          nList = self.htmlDom.find(selector)
+          memo = {}
           parentsList = []
-          tmpList = []
-          selectedNodesList = []
           for node in self.nodeList:
-               if not node.ancestorList:
-                    node.generateAncestorList()
-               tmpList = node.ancestorList
-               for selectedNode in nList.nodeList:
-                    try:
-                         index = tmpList.index( selectedNode )
-                         selectedNodeList = tmpList[:index]
-                         parentsList += self.getUniqueNodes( parentsList, selectedNodeList )
-                         break
-                    except ValueError:
-                         pass
-               else:
-                    parentsList += self.getUniqueNodes( parentsList, tmpList )
-          parentsList = sorted( parentsList, key = lambda x: x.pos )
+               tmpList = []
+               index = -1
+               for parent in node.ancestors():
+                    #the outer most matching ancestor decides where to stop.
+                    if self.htmlDom.matches( parent, selector, memo ):
+                         index = len( tmpList )
+                    tmpList.append( parent )
+               if index != -1:
+                    tmpList = tmpList[:index]
+               parentsList += tmpList
+          parentsList = sorted( uniqueNodes( parentsList ), key = lambda x: x.pos )
           return HtmlNodeList( parentsList, self.htmlDom, self.nodeList, self )
           
      def add(self,selector):
@@ -1056,15 +2146,12 @@ class HtmlNodeList:
              This function adds new elements to the current list.
           """
           nList = self.htmlDom.find( selector )
-          newNodeList = self.nodeList + self.getUniqueNodes( self.nodeList, nList.nodeList )
+          newNodeList = uniqueNodes( self.nodeList + nList.nodeList )
           newNodeList = sorted( newNodeList, key = lambda x: x.pos )
           return HtmlNodeList( newNodeList, self.htmlDom, self.nodeList,self )
           
      def andSelf(self):
-          newList = []
-          newList += self.getUniqueNodes( newList, self.previousNodeList )
-          newList += self.getUniqueNodes( newList, self.nodeList )
-          
+          newList = uniqueNodes( self.previousNodeList + self.nodeList )
           newList = sorted( newList, key = lambda x: x.pos )
           return HtmlNodeList( newList, self.htmlDom, self.nodeList,self )
      
@@ -1076,25 +2163,69 @@ class HtmlNodeList:
           return HtmlNodeList( nList.nodeList, self.htmlDom, self.nodeList, self )
 
      def write( self,fileName ):
-          import codecs
-          fp = codecs.open( fileName, "w","utf-8")
-          fp.write( self.html() )
-          fp.close()
+          # the pieces go straight to the file, the html of the set is never built.
+          with open( fileName, "w", encoding="utf-8", newline="" ) as fp:
+               serializeNodes( self.nodeList, fp.write )
           return self
      def length(self):
           return len(self.nodeList)
           
      def contains( self, pattern ):
           pattern = re.compile( pattern )
+          nodes = sorted( uniqueNodes( self.nodeList ), key = lambda x: x.pos )
+          # only a set with nested nodes searches the same text more than once, and
+          # that is cheap when the texts of the nodes have been cached by getText().
+          nested = False
+          cached = True
+          lastEnd = -1
+          for node in nodes:
+               if node.pos < lastEnd:
+                    nested = True
+               lastEnd = max( lastEnd, node.endPos )
+               if node.textCache is None:
+                    cached = False
           selectedNodeList = []
-          for node in self.nodeList:
-            text = node.getText()
-            if pattern.search( text ):
-              selectedNodeList += self.getUniqueNodes( selectedNodeList, [node] )
-              
+          if not nested or cached or not isinstance( pattern.pattern, str ) or contextPattern.search( pattern.pattern ):
+               for node in nodes:
+                 text = node.getText()
+                 if pattern.search( text ):
+                   selectedNodeList.append( node )
+          else:
+               # Without anchors and lookarounds a match only depends on the text it
+               # covers, so the nodes are searched within the text of the document and
+               # a node can only match where the enclosing node has matched: at or after
+               # the first match of the enclosing node.
+               text, ranges = self.htmlDom.getTextRanges()
+               # ( end, match start, match end ) of the searched nodes around the current one.
+               enclosing = []
+               for node in nodes:
+                    span = ranges.get( node )
+                    if span is None:
+                         if pattern.search( node.getText() ):
+                              selectedNodeList.append( node )
+                         continue
+                    start, end = span
+                    while enclosing and enclosing[ -1 ][ 0 ] <= start:
+                         enclosing.pop()
+                    if not enclosing:
+                         match = pattern.search( text, start, end )
+                         matchStart, matchEnd = match.span() if match else ( None, None )
+                    else:
+                         outerEnd, matchStart, matchEnd = enclosing[ -1 ]
+                         if matchStart is None:
+                              # nothing inside the enclosing node matches.
+                              continue
+                         if not ( start <= matchStart and matchEnd <= end ):
+                              start = max( start, matchStart )
+                              match = pattern.search( text, start, end ) if start <= end else None
+                              matchStart, matchEnd = match.span() if match else ( None, None )
+                    enclosing.append( ( end, matchStart, matchEnd ) )
+                    if matchStart is not None:
+                         selectedNodeList.append( node )
+
           selectedNodeList = sorted( selectedNodeList, key = lambda x: x.pos )
           return HtmlNodeList( selectedNodeList, self.htmlDom, self.nodeList, self )
-          
+
      def toList(self):
          return self.nodeList
      
@@ -1105,7 +2236,7 @@ class HtmlNodeList:
         elif isinstance( nodes, list ):
             nodes = nodes
         elif isinstance( nodes, str ):
-            h = HtmlDom().createDom( nodes )
+            h = parseFragment( nodes )
             h.domDictToList()
             nodes = h.domNodesList
             tmpList = []
@@ -1128,6 +2259,7 @@ class HtmlNodeList:
                     node.parentNode.remove( node )
                 self.nodeList[ 0 ].append( node )
                 self.htmlDom.registerNode( node.nodeName, node )
+                self.htmlDom.placeNode( node )
         else:
             removedAll = False
             for eachNode in self.nodeList:
@@ -1142,8 +2274,8 @@ class HtmlNodeList:
                     node_c = node.copy()
                     eachNode.append( node_c )
                     self.htmlDom.registerNode( node_c.nodeName, node_c )
+                    self.htmlDom.placeNode( node_c )
         self.htmlDom.sorted = False
-        modifyPositions( self.htmlDom.referenceToRootElement )
         return self
                 
      def prepend( self, nodes ):
@@ -1153,7 +2285,7 @@ class HtmlNodeList:
         elif isinstance( nodes, list ):
             nodes = nodes[ ::-1]
         elif isinstance( nodes, str ):
-            h = HtmlDom().createDom( nodes )
+            h = parseFragment( nodes )
             h.domDictToList()
             nodes = h.domNodesList
             tmpList = []
@@ -1177,6 +2309,7 @@ class HtmlNodeList:
                     node.parentNode.remove( node )
                 self.nodeList[ 0 ].prepend( node )
                 self.htmlDom.registerNode( node.nodeName, node )
+                self.htmlDom.placeNode( node )
         else:
             removedAll = False
             for eachNode in self.nodeList:
@@ -1191,8 +2324,8 @@ class HtmlNodeList:
                     node_c = node.copy()
                     eachNode.prepend( node_c )
                     self.htmlDom.registerNode( node_c.nodeName, node_c )
+                    self.htmlDom.placeNode( node_c )
         self.htmlDom.sorted = False
-        modifyPositions( self.htmlDom.referenceToRootElement )
         return self
      def after( self, nodes ):
         flag = False
@@ -1201,7 +2334,7 @@ class HtmlNodeList:
         elif isinstance( nodes, list ):
             nodes = nodes[::-1]
         elif isinstance( nodes, str ):
-            h = HtmlDom().createDom( nodes )
+            h = parseFragment( nodes )
             h.domDictToList()
             nodes = h.domNodesList
             tmpList = []
@@ -1229,6 +2362,7 @@ class HtmlNodeList:
                 else:
                     self.nodeList[ 0 ].after( None, node )
                 self.htmlDom.registerNode( node.nodeName, node )
+                self.htmlDom.placeNode( node )
         else:
             removedAll = False
             for eachNode in self.nodeList:
@@ -1247,8 +2381,8 @@ class HtmlNodeList:
                     else:
                         eachNode.after( None, node_c, self.htmlDom )
                     self.htmlDom.registerNode( node_c.nodeName, node_c )
+                    self.htmlDom.placeNode( node_c )
         self.htmlDom.sorted = False
-        modifyPositions( self.htmlDom.referenceToRootElement )
         return self
      def before( self, nodes ):
         flag = False
@@ -1257,7 +2391,7 @@ class HtmlNodeList:
         elif isinstance( nodes, list ):
             nodes = nodes
         elif isinstance( nodes, str ):
-            h = HtmlDom().createDom( nodes )
+            h = parseFragment( nodes )
             h.domDictToList()
             nodes = h.domNodesList
             tmpList = []
@@ -1283,7 +2417,8 @@ class HtmlNodeList:
                     parent.before( self.nodeList[ 0 ], node )
                 else:
                     self.nodeList[ 0 ].before( None, node )
-                self.htmlDom.registerNode( node.nodeName, node )                    
+                self.htmlDom.registerNode( node.nodeName, node )
+                self.htmlDom.placeNode( node )
         else:
             removedAll = False
             for eachNode in self.nodeList:
@@ -1302,8 +2437,8 @@ class HtmlNodeList:
                     else:
                         eachNode.before( None, node_c )
                     self.htmlDom.registerNode( node_c.nodeName, node_c )
+                    self.htmlDom.placeNode( node_c )
         self.htmlDom.sorted = False
-        modifyPositions( self.htmlDom.referenceToRootElement )
         return self
      
      def appendTo( self, nodes, context = None ):
@@ -1321,10 +2456,6 @@ class HtmlNodeList:
                 cotext.find( nodes ).append( self )
             else:
                 self.htmlDom.find( nodes ).append( self )
-        if not context:
-            modifyPositions( self.htmlDom.referenceToRootElement )
-        else:
-            modifyPositions( context.referenceToRootElement )
         return self
      def prependTo( self, nodes, context = None ):
         """ 
@@ -1342,10 +2473,6 @@ class HtmlNodeList:
             else:
                 self.htmlDom.find( nodes ).prepend( self )
                 
-        if not context:
-            modifyPositions( self.htmlDom.referenceToRootElement )
-        else:
-            modifyPositions( context.referenceToRootElement )                
         return self
         
      def insertAfter( self, nodes, context = None ):
@@ -1356,10 +2483,6 @@ class HtmlNodeList:
                 context.find( nodes ).after( self )
             else:
                 self.htmlDom.find( nodes ).after( self )
-        if not context:
-            modifyPositions( self.htmlDom.referenceToRootElement )
-        else:
-            modifyPositions( context.referenceToRootElement )                
         return self
         
      def insertBefore( self, nodes, context = None ):
@@ -1370,10 +2493,6 @@ class HtmlNodeList:
                 context.find( nodes ).before( self )
             else:
                 self.htmlDom.find( nodes ).before( self )
-        if not context:
-            modifyPositions( self.htmlDom.referenceToRootElement )
-        else:
-            modifyPositions( context.referenceToRootElement )                
         return self
      
      def remove( self, selector = None ):
@@ -1394,12 +2513,1090 @@ class HtmlNodeList:
         return self.nodeList[ 0 ]
      
      def getUniqueNodes(self,srcList, newList ):
+          srcSet = set( srcList )
+          return [ selectedNode for selectedNode in newList if selectedNode not in srcSet ]
+
+class HtmlFlatDom:
+     """
+          A read-only dom which keeps its nodes in array columns instead of a HtmlDomNode
+          object per node. Node i is the i-th node in document order; its subtree holds
+          the nodes i + 1 to ends[ i ] - 1. find() and the HtmlFlatNodeList functions work
+          on these indexes, node( i ) creates the HtmlDomNode of a node on request.
+     """
+     def __init__( self, url="" ):
+          self.baseURL = url
+          self.xml_file = False
+          #@var:kinds holds the nodeType of every node and @var:tags the index of its
+          # nodeName in tagNames ( "text" for text nodes, like in HtmlDom ).
+          self.kinds = array( 'b' )
+          self.tags = array( 'i' )
+          #@var:parents, @var:firstChildren, @var:nextSiblings and @var:previousSiblings
+          # link the nodes like the HtmlDomNode fields do, -1 stands for None.
+          self.parents = array( 'i' )
+          self.firstChildren = array( 'i' )
+          self.nextSiblings = array( 'i' )
+          self.previousSiblings = array( 'i' )
+          self.ends = array( 'i' )
+          #@var:text holds the text of the document the way getTextRanges() joins it:
+          # getText() of an element and the text of a text node are slices of it.
+          self.text = ""
+          self.textStarts = array( 'q' )
+          self.textEnds = array( 'q' )
+          #the attributes of node i are the rows attrStarts[ i ] to attrStarts[ i + 1 ] - 1,
+          #their values are slices of attrText with the values joined by a space.
+          self.attrStarts = array( 'i' )
+          self.attrNames = array( 'i' )
+          self.attrText = ""
+          self.attrValueStarts = array( 'q' )
+          self.attrValueEnds = array( 'q' )
+          self.tagNames = []
+          self.tagIds = {}
+          self.attributeNames = []
+          self.attributeIds = {}
+          #@var:topLevelNodes holds the nodes without a parent.
+          self.topLevelNodes = array( 'i' )
+          #the indexes map a tag id, class value, id value or attribute name id to
+          #the nodes which carry it, in document order.
+          self.tagIndex = {}
+          self.classIndex = {}
+          self.idIndex = {}
+          self.attributeIndex = {}
+          #@var:builder holds the state of a parse started by feed() until close().
+          self.builder = None
+
+     def createDom( self, htmlString ):
+          for start in range( 0, len( htmlString ), flatChunkSize ):
+               self.feed( htmlString[ start:start + flatChunkSize ] )
+          return self.close()
+
+     # the file is decoded and fed a chunk at a time, exactly like for a HtmlDom.
+     fromFile = classmethod( HtmlDom.fromFile.__func__ )
+
+     def feed( self, chunk ):
+          if self.builder is None:
+               self.builder = HtmlFlatBuilder( self )
+          self.builder.feed( chunk )
+          return self
+
+     def close( self ):
+          if self.builder is None:
+               self.builder = HtmlFlatBuilder( self )
+          self.builder.close()
+          self.builder = None
+          return self
+
+     def length( self ):
+          return len( self.kinds )
+
+     def tagId( self, nodeName ):
+          tagId = self.tagIds.get( nodeName )
+          if tagId is None:
+               tagId = self.tagIds[ nodeName ] = len( self.tagNames )
+               self.tagNames.append( nodeName )
+          return tagId
+
+     def attributeId( self, attrName ):
+          nameId = self.attributeIds.get( attrName )
+          if nameId is None:
+               nameId = self.attributeIds[ attrName ] = len( self.attributeNames )
+               self.attributeNames.append( attrName )
+          return nameId
+
+     def nodeName( self, index ):
+          return self.tagNames[ self.tags[ index ] ]
+
+     def getText( self, index ):
+          # like HtmlTextNode.getText(), a text node has no text of its own.
+          if self.kinds[ index ] == 3:
+               return ""
+          return self.text[ self.textStarts[ index ]:self.textEnds[ index ] ]
+
+     def getAttributes( self, index ):
+          """
+               Returns the attributes of a node as a new { name: values } dict.
+          """
+          attributes = {}
+          attrText = self.attrText
+          for row in range( self.attrStarts[ index ], self.attrStarts[ index + 1 ] ):
+               attributes[ self.attributeNames[ self.attrNames[ row ] ] ] = attrText[ self.attrValueStarts[ row ]:self.attrValueEnds[ row ] ].split()
+          return attributes
+
+     def attributeValue( self, index, attrName ):
+          """
+               Returns the values of an attribute of a node joined by a space, None
+               if the node does not carry it.
+          """
+          nameId = self.attributeIds.get( attrName )
+          if nameId is not None:
+               attrNames = self.attrNames
+               for row in range( self.attrStarts[ index ], self.attrStarts[ index + 1 ] ):
+                    if attrNames[ row ] == nameId:
+                         return self.attrText[ self.attrValueStarts[ row ]:self.attrValueEnds[ row ] ]
+          return None
+
+     def attr( self, index, attrName ):
+          value = self.attributeValue( index, attrName )
+          return "Undefined Attribute" if value is None else value
+
+     def node( self, index ):
+          """
+               Returns a HtmlDomNode holding a copy of the node and its descendants.
+          """
+          kinds = self.kinds
+          parents = self.parents
+          created = {}
+          for current in range( index, self.ends[ index ] ):
+               if kinds[ current ] == 3:
+                    domNode = HtmlDomNode( "text" )
+                    domNode.text = self.text[ self.textStarts[ current ]:self.textEnds[ current ] ]
+               else:
+                    domNode = HtmlDomNode( self.tagNames[ self.tags[ current ] ], 1 )
+                    if self.attrStarts[ current ] != self.attrStarts[ current + 1 ]:
+                         domNode.attributes = self.getAttributes( current )
+               if current != index:
+                    created[ parents[ current ] ].addChild( domNode )
+               created[ current ] = domNode
+          return created[ index ]
+
+     def find( self, selectors, nList = () ):
+          """
+               Works like HtmlDom.find(), nList is the optional context as a list of node indexes.
+          """
+          return HtmlFlatNodeList( sorted( selectNodes( self, selectors, nList ) ), self )
+
+     def matches( self, index, selectors, memo = None ):
+          return selectorMatches( self, index, selectors, memo )
+
+     # the accessors used by selectNodes() and selectorMatches().
+     def parentOf( self, index ):
+          parent = self.parents[ index ]
+          return parent if parent >= 0 else None
+
+     def previousSiblingOf( self, index ):
+          previous = self.previousSiblings[ index ]
+          return previous if previous >= 0 else None
+
+     def descendantTest( self, ancestors ):
+          """
+               Returns a function which tells whether a node is a descendant of any of
+               the ancestors, see descendantTest().
+          """
+          ends = self.ends
+          return intervalTest( ( index, ends[ index ] ) for index in ancestors )
+
+     def elementNodes( self ):
+          kinds = self.kinds
+          return [ index for index in range( len( kinds ) ) if kinds[ index ] == 1 ]
+
+     def nodesNamed( self, nodeName ):
+          return self.tagIndex.get( self.tagIds.get( nodeName ), () )
+
+     def matchesStep( self, index, step ):
+          elemName = step.elemName
+          if elemName == "*":
+               if self.kinds[ index ] != 1:
+                    return False
+          elif elemName and self.tagNames[ self.tags[ index ] ] != elemName:
+               return False
+          return self.acceptsNode( index, step )
+
+     def acceptsNode( self, index, step ):
+          return stepAccepts( step, functools.partial( self.attributeValues, index ) )
+
+     def attributeValues( self, index, attrName ):
+          """
+               Returns the values of an attribute of a node as a list, None if the node
+               does not carry it.
+          """
+          value = self.attributeValue( index, attrName )
+          return value.split() if value is not None else None
+
+     def getNodesWithClassOrId( self, className = "", selectType = "" ):
+          index = self.classIndex if selectType == "class" else self.idIndex
+          return index.get( className, () )
+
+     def getNodesWithAttributes( self, attributeSelector, attributeSelectorFlags ):
+          key, attrValue = list( attributeSelector.items() )[0]
+          if attrValue or not ( attributeSelectorFlags['$'] or attributeSelectorFlags['^'] or attributeSelectorFlags['*'] ):
+               candidates = self.attributeIndex.get( self.attributeIds.get( key ), () )
+          else:
+               candidates = range( len( self.kinds ) )
+          return [ index for index in candidates if attributeAccepts( self.attributeValues( index, key ), attrValue, attributeSelectorFlags ) ]
+
+class HtmlFlatBuilder:
+     """
+          Moves the nodes parsed by a HtmlDomParser into the columns of a HtmlFlatDom.
+          A node is added once the nodes before it in document order are known and is
+          then dropped from the tree, so only the open elements stay in memory.
+     """
+     def __init__( self, flat ):
+          self.flat = flat
+          # the fields of a HtmlDom which HtmlDomParser uses.
+          self.xml_file = flat.xml_file
+          self.domNodesList = []
+          self.topLevelNodes = []
+          self.referenceToRootElement = None
+          #@var:open maps the open elements to their index.
+          self.open = {}
+          #@var:lastChildren maps the index of an open element to its last added child.
+          self.lastChildren = {}
+          self.textBuffer = io.StringIO()
+          self.textLength = 0
+          self.attrBuffer = io.StringIO()
+          self.attrLength = 0
+          self.parser = HtmlDomParser( self )
+          self.parser.startNode = self.startNode
+          self.parser.endNode = self.endNode
+
+     def registerNode( self, nodeName, domNode ):
+          pass
+
+     def feed( self, chunk ):
+          self.parser.feed( chunk )
+          del self.domNodesList[:]
+
+     def close( self ):
+          self.parser.close()
+          self.addTopLevelNodes( None )
+          flat = self.flat
+          flat.attrStarts.append( len( flat.attrNames ) )
+          flat.text = self.textBuffer.getvalue()
+          flat.attrText = self.attrBuffer.getvalue()
+
+     def addTopLevelNodes( self, element ):
+          # the top level text nodes in front of element.
+          for domNode in self.topLevelNodes:
+               if domNode is not element:
+                    self.addNode( domNode, -1 )
+          del self.topLevelNodes[:]
+
+     def startNode( self, domNode ):
+          parent = domNode.parentNode
+          if parent is None:
+               self.addTopLevelNodes( domNode )
+               index = self.addNode( domNode, -1 )
+          else:
+               parentIndex = self.open[ parent ]
+               # the text nodes in front of domNode.
+               for child in parent.children[ :-1 ]:
+                    self.addNode( child, parentIndex )
+               parent.children = noChildren
+               index = self.addNode( domNode, parentIndex )
+          self.open[ domNode ] = index
+          self.lastChildren[ index ] = -1
+
+     def endNode( self, domNode ):
+          index = self.open.pop( domNode )
+          for child in domNode.children:
+               self.addNode( child, index )
+          domNode.children = noChildren
+          del self.lastChildren[ index ]
+          flat = self.flat
+          flat.textEnds[ index ] = self.textLength
+          self.textBuffer.write( '\n' )
+          self.textLength += 1
+          flat.ends[ index ] = len( flat.kinds )
+
+     def addNode( self, domNode, parent ):
+          flat = self.flat
+          index = len( flat.kinds )
+          flat.parents.append( parent )
+          flat.firstChildren.append( -1 )
+          flat.nextSiblings.append( -1 )
+          if parent >= 0:
+               previous = self.lastChildren[ parent ]
+               if previous < 0:
+                    flat.firstChildren[ parent ] = index
+               else:
+                    flat.nextSiblings[ previous ] = index
+               flat.previousSiblings.append( previous )
+               self.lastChildren[ parent ] = index
+          else:
+               flat.previousSiblings.append( -1 )
+               flat.topLevelNodes.append( index )
+          flat.attrStarts.append( len( flat.attrNames ) )
+          flat.textStarts.append( self.textLength )
+          tagId = flat.tagId( domNode.nodeName )
+          flat.tags.append( tagId )
+          flat.tagIndex.setdefault( tagId, array( 'i' ) ).append( index )
+          if domNode.nodeType == 3:
+               flat.kinds.append( 3 )
+               self.textBuffer.write( domNode.text )
+               self.textLength += len( domNode.text )
+               flat.textEnds.append( self.textLength )
+               flat.ends.append( index + 1 )
+               return index
+          flat.kinds.append( 1 )
+          # both are set by endNode().
+          flat.textEnds.append( -1 )
+          flat.ends.append( -1 )
+          for attrName, values in domNode.attributes.items():
+               nameId = flat.attributeId( attrName )
+               flat.attrNames.append( nameId )
+               flat.attributeIndex.setdefault( nameId, array( 'i' ) ).append( index )
+               value = " ".join( values )
+               flat.attrValueStarts.append( self.attrLength )
+               self.attrBuffer.write( value )
+               self.attrLength += len( value )
+               flat.attrValueEnds.append( self.attrLength )
+               if attrName == "class":
+                    valueIndex = flat.classIndex
+               elif attrName == "id":
+                    valueIndex = flat.idIndex
+               else:
+                    continue
+               for value in values:
+                    nodes = valueIndex.setdefault( value, array( 'i' ) )
+                    if not nodes or nodes[ -1 ] != index:
+                         nodes.append( index )
+          return index
+
+class HtmlFlatNodeList:
+     """
+          The HtmlNodeList of a HtmlFlatDom: it holds node indexes in document order
+          and creates HtmlDomNode objects only for html() and toList().
+     """
+     def __init__( self, nodeList, dom ):
+          self.nodeList = nodeList
+          self.htmlDom = dom
+
+     def __iter__( self ):
+          for index in range( len( self.nodeList ) ):
+               yield self.eq( index )
+
+     def __getitem__( self, index ):
+          if isinstance( index, int ):
+              return self.eq( index )
+          elif isinstance( index, slice ):
+              return HtmlFlatNodeList( self.nodeList[ index ], self.htmlDom )
+
+     def length( self ):
+          return len( self.nodeList )
+
+     def eq( self, index ):
+          if index >= -len( self.nodeList ) and index < len( self.nodeList ):
+               return HtmlFlatNodeList( [ self.nodeList[ index ] ], self.htmlDom )
+          else:
+               return None
+
+     def first( self ):
+          return self.eq( 0 )
+
+     def last( self ):
+          return self.eq( len( self.nodeList ) - 1 )
+
+     def toList( self ):
+          return [ self.htmlDom.node( index ) for index in self.nodeList ]
+
+     def select( self, nodeList, selector ):
+          # the result of a traversal: unique indexes in document order.
+          nodeList = sorted( set( nodeList ) )
+          if selector:
+               return self.filter( selector, nodeList )
+          return HtmlFlatNodeList( nodeList, self.htmlDom )
+
+     def find( self, selector ):
+          return self.htmlDom.find( selector, self.nodeList )
+
+     def filter( self, selector, nodeList = None ):
+          memo = {}
+          dom = self.htmlDom
+          if nodeList is None:
+               nodeList = sorted( set( self.nodeList ) )
+          return HtmlFlatNodeList( [ index for index in nodeList if dom.matches( index, selector, memo ) ], dom )
+
+     def _not( self, selector ):
+          memo = {}
+          dom = self.htmlDom
+          return HtmlFlatNodeList( [ index for index in sorted( set( self.nodeList ) ) if not dom.matches( index, selector, memo ) ], dom )
+
+     def _is( self, selector ):
+          memo = {}
+          for index in self.nodeList:
+               if self.htmlDom.matches( index, selector, memo ):
+                    return True
+          return False
+
+     def has( self, selector ):
+          found = self.htmlDom.find( selector ).nodeList
+          ends = self.htmlDom.ends
           tmpList = []
-          for selectedNode in newList:
-               if selectedNode not in srcList:
-                    tmpList.append( selectedNode  )
-                    
-          return tmpList
+          for index in self.nodeList:
+               position = bisect.bisect_right( found, index )
+               if position < len( found ) and found[ position ] < ends[ index ]:
+                    tmpList.append( index )
+          return self.select( tmpList, None )
+
+     def children( self, selector = None, all_children = False ):
+          dom = self.htmlDom
+          kinds = dom.kinds
+          nextSiblings = dom.nextSiblings
+          tmpList = []
+          for index in self.nodeList:
+               child = dom.firstChildren[ index ]
+               while child >= 0:
+                    if all_children or kinds[ child ] == 1:
+                         tmpList.append( child )
+                    child = nextSiblings[ child ]
+          return self.select( tmpList, selector )
+
+     def parent( self, selector = None ):
+          parents = self.htmlDom.parents
+          return self.select( [ parents[ index ] for index in self.nodeList if parents[ index ] >= 0 ], selector )
+
+     def parents( self, selector = None ):
+          parents = self.htmlDom.parents
+          seen = set()
+          for index in self.nodeList:
+               parent = parents[ index ]
+               # the ancestors of a seen node have been collected already.
+               while parent >= 0 and parent not in seen:
+                    seen.add( parent )
+                    parent = parents[ parent ]
+          return self.select( seen, selector )
+
+     def parentsUntil( self, selector ):
+          memo = {}
+          dom = self.htmlDom
+          parents = dom.parents
+          tmpList = []
+          for index in self.nodeList:
+               ancestors = []
+               stop = -1
+               parent = parents[ index ]
+               while parent >= 0:
+                    #the outer most matching ancestor decides where to stop.
+                    if dom.matches( parent, selector, memo ):
+                         stop = len( ancestors )
+                    ancestors.append( parent )
+                    parent = parents[ parent ]
+               tmpList += ancestors[ :stop ] if stop != -1 else ancestors
+          return self.select( tmpList, None )
+
+     def siblingsOf( self, index, links ):
+          # the element siblings after ( or before ) the node, nearest first.
+          kinds = self.htmlDom.kinds
+          siblings = []
+          index = links[ index ]
+          while index >= 0:
+               if kinds[ index ] == 1:
+                    siblings.append( index )
+               index = links[ index ]
+          return siblings
+
+     def next( self, selector = None ):
+          return self.nearestSiblings( self.htmlDom.nextSiblings, selector )
+
+     def prev( self, selector = None ):
+          return self.nearestSiblings( self.htmlDom.previousSiblings, selector )
+
+     def nearestSiblings( self, links, selector ):
+          kinds = self.htmlDom.kinds
+          tmpList = []
+          for index in self.nodeList:
+               sibling = links[ index ]
+               while sibling >= 0 and kinds[ sibling ] == 3:
+                    sibling = links[ sibling ]
+               if sibling >= 0:
+                    tmpList.append( sibling )
+          return self.select( tmpList, selector )
+
+     def nextAll( self, selector = None ):
+          return self.allSiblings( self.htmlDom.nextSiblings, selector )
+
+     def prevAll( self, selector = None ):
+          return self.allSiblings( self.htmlDom.previousSiblings, selector )
+
+     def allSiblings( self, links, selector ):
+          kinds = self.htmlDom.kinds
+          tmpList = []
+          seen = set()
+          for index in self.nodeList:
+               sibling = links[ index ]
+               # the siblings beyond a seen sibling have been collected already.
+               while sibling >= 0 and sibling not in seen:
+                    seen.add( sibling )
+                    if kinds[ sibling ] == 1:
+                         tmpList.append( sibling )
+                    sibling = links[ sibling ]
+          return self.select( tmpList, selector )
+
+     def nextUntil( self, selector ):
+          memo = {}
+          dom = self.htmlDom
+          tmpList = []
+          for index in self.nodeList:
+               siblings = self.siblingsOf( index, dom.nextSiblings )
+               #the nearest matching sibling decides where to stop.
+               for position, sibling in enumerate( siblings ):
+                    if dom.matches( sibling, selector, memo ):
+                         siblings = siblings[ :position ]
+                         break
+               tmpList += siblings
+          return self.select( tmpList, None )
+
+     def prevUntil( self, selector ):
+          memo = {}
+          dom = self.htmlDom
+          tmpList = []
+          for index in self.nodeList:
+               siblings = self.siblingsOf( index, dom.previousSiblings )
+               #the matching sibling which comes first in the document decides where to stop.
+               stop = -1
+               for position, sibling in enumerate( siblings ):
+                    if dom.matches( sibling, selector, memo ):
+                         stop = position
+               tmpList += siblings[ :stop ] if stop != -1 else siblings
+          return self.select( tmpList, None )
+
+     def siblings( self, selector = None ):
+          dom = self.htmlDom
+          kinds = dom.kinds
+          nextSiblings = dom.nextSiblings
+          # the children of every parent are visited once, see HtmlNodeList.siblings().
+          selectedChildren = {}
+          tmpList = []
+          for index in self.nodeList:
+               parent = dom.parents[ index ]
+               if parent >= 0:
+                    selectedChildren.setdefault( parent, set() ).add( index )
+          for parent, selected in selectedChildren.items():
+               child = dom.firstChildren[ parent ]
+               while child >= 0:
+                    if kinds[ child ] == 1 and ( len( selected ) > 1 or child not in selected ):
+                         tmpList.append( child )
+                    child = nextSiblings[ child ]
+          return self.select( tmpList, selector )
+
+     def add( self, selector ):
+          return self.select( list( self.nodeList ) + list( self.htmlDom.find( selector ).nodeList ), None )
+
+     def text( self ):
+          return "".join( [ self.htmlDom.getText( index ) for index in self.nodeList ] )
+
+     def html( self ):
+          pieces = []
+          serializeNodes( self.toList(), pieces.append )
+          return "".join( pieces )
+
+     def write( self, fileName ):
+          with open( fileName, "w", encoding = "utf-8", newline = "" ) as fp:
+               serializeNodes( self.toList(), fp.write )
+          return self
+
+     def attr( self, attrName ):
+          if len( self.nodeList ) > 0:
+               return self.htmlDom.attr( self.nodeList[0], attrName )
+          raise IndexError
+
+     def contains( self, pattern ):
+          pattern = re.compile( pattern )
+          dom = self.htmlDom
+          text = dom.text
+          # the text of an element is a slice of dom.text, which needs no copy unless
+          # the pattern looks at what is around the match.
+          inPlace = isinstance( pattern.pattern, str ) and not contextPattern.search( pattern.pattern )
+          tmpList = []
+          for index in sorted( set( self.nodeList ) ):
+               if dom.kinds[ index ] == 3:
+                    found = pattern.search( "" )
+               elif inPlace:
+                    found = pattern.search( text, dom.textStarts[ index ], dom.textEnds[ index ] )
+               else:
+                    found = pattern.search( dom.getText( index ) )
+               if found:
+                    tmpList.append( index )
+          return HtmlFlatNodeList( tmpList, dom )
+
+def parseFragment( html ):
+    """
+        Returns a HtmlDom of the html fragment. Fragments are parsed directly, they
+        would only push whole documents out of the snapshot cache.
+    """
+    dom = HtmlDom()
+    HtmlDomParser( dom, html ).close()
+    return dom
+
+def subtreeNodeList( root ):
+    """
+        Returns a HtmlNodeList holding root, a node without a parent, with a HtmlDom
+        of its own for root and its descendants.
+    """
+    dom = HtmlDom()
+    stack = [ root ]
+    while stack:
+        child = stack.pop()
+        dom.registerNode( child.nodeName, child )
+        stack.extend( child.children )
+    dom.referenceToRootElement = root
+    dom.topLevelNodes.append( root )
+    dom.renumber()
+    return HtmlNodeList( [ root ], dom )
+
+def contentCharset( contentType ):
+    """
+        Returns the charset of a Content-Type header value, utf-8 if it has none.
+    """
+    encoding = 'utf-8'
+    if contentType:
+        try:
+            encoding = contentType.split( ";" )[ 1 ].split( '=' )[ 1 ].strip().strip( '"\'' )
+        except IndexError:
+            pass
+    return encoding
+
+def decodeBody( body, contentEncoding ):
+    """
+        Returns body uncompressed according to a Content-Encoding header value.
+    """
+    contentEncoding = ( contentEncoding or "" ).strip().lower()
+    if contentEncoding in ( "gzip", "x-gzip" ):
+        return gzip.decompress( body )
+    if contentEncoding == "deflate":
+        try:
+            return zlib.decompress( body )
+        except zlib.error:
+            # some servers send deflate data without the zlib header.
+            return zlib.decompress( body, -zlib.MAX_WBITS )
+    return body
+
+def sniffEncoding( head ):
+    """
+        Returns the encoding of a file starting with the bytes head, taken from its
+        byte order mark or its <meta> charset, else utf-8.
+    """
+    for bom, encoding in ( ( codecs.BOM_UTF8, 'utf-8-sig' ),
+                           ( codecs.BOM_UTF16_LE, 'utf-16' ),
+                           ( codecs.BOM_UTF16_BE, 'utf-16' ) ):
+        if head.startswith( bom ):
+            return encoding
+    match = metaCharset.search( head )
+    if match:
+        try:
+            return codecs.lookup( match.group( 1 ).decode( 'ascii' ) ).name
+        except LookupError:
+            pass
+    return 'utf-8'
+
+def serializeNodes( nodes, write, spaces = 0 ):
+    """
+        Passes the html of each node in nodes, indented by spaces, to write() one
+        piece at a time. The tree is walked with a stack instead of recursion, so
+        any nesting depth can be written.
+    """
+    indent = " " * spaces
+    # every open element has a frame holding an iterator over the children left to
+    # write, the indent of those children, the indent of their end tags and the end
+    # tag of the element itself. Apart from the nodes themselves, each indent starts
+    # with a line break.
+    stack = [ ( iter( nodes ), indent, "\n" + indent, "" ) ]
+    while stack:
+        children, indent, lineIndent, endTag = stack[ -1 ]
+        for node in children:
+            # a text node in nodes itself is written like an empty "text" element,
+            # as HtmlDomNode.html() always did.
+            if node.nodeType == 3 and len( stack ) > 1:
+                write( indent + node.text.strip() )
+                continue
+            nodeName = node.nodeName
+            if node.attributes:
+                write( indent + "<" + nodeName + "".join( [ ' ' + attrName + '="' + " ".join( values ) + '"'
+                                                            for attrName, values in node.attributes.items() ] ) + ">" )
+            else:
+                write( indent + "<" + nodeName + ">" )
+            if node.children:
+                childIndent = lineIndent + "    "
+                stack.append( ( iter( node.children ), childIndent, childIndent, lineIndent + "</" + nodeName + ">" ) )
+                break
+            write( lineIndent + "</" + nodeName + ">" )
+        else:
+            stack.pop()
+            write( endTag )
+
+def joinText( node ):
+    """
+        Returns the text of the descendants of node: text nodes as they are and a
+        line break after every element. Cached texts of descendants are reused.
+    """
+    pieces = []
+    # a stack of iterators over the children left to visit.
+    stack = [ iter( node.children ) ]
+    while stack:
+        for child in stack[ -1 ]:
+            if child.nodeType == 3:
+                pieces.append( child.text )
+            elif child.textCache is not None:
+                pieces.append( child.textCache )
+                pieces.append( '\n' )
+            elif child.children:
+                stack.append( iter( child.children ) )
+                break
+            else:
+                pieces.append( '\n' )
+        else:
+            stack.pop()
+            if stack:
+                pieces.append( '\n' )
+    return "".join( pieces )
+
+def iterFind( source, selector, chunkSize = 1 << 16 ):
+    """
+        Yields every element of the html document source which is selected by the
+        css selector, as a HtmlNodeList holding a copy of the element, as soon as
+        its end has been parsed. Elements come in the order their end tags appear.
+        The document is parsed in chunks and everything which can no longer be
+        selected is dropped, so memory depends on the nesting depth of the document
+        rather than its size.
+        source is a string, a file object or an iterable of strings.
+    """
+    if isinstance( source, str ):
+        chunks = ( source[ index:index + chunkSize ] for index in range( 0, len( source ), chunkSize ) )
+    elif hasattr( source, "read" ):
+        chunks = iter( lambda: source.read( chunkSize ), "" )
+    else:
+        chunks = source
+    stream = HtmlNodeStream( selector )
+    for chunk in chunks:
+        for nodeList in stream.feed( chunk ):
+            yield nodeList
+    for nodeList in stream.close():
+        yield nodeList
+
+async def fetchAll( urls, concurrency = 8, timeout = None, returnExceptions = False, fetcher = None ):
+    """
+        Coroutine which downloads and parses the urls with fetcher ( see readURL ),
+        at most concurrency of them at a time, and returns their doms in the order
+        of urls. If returnExceptions
+        is set, the error of a failed url takes the place of its dom, else the first
+        error is raised.
+    """
+    semaphore = asyncio.Semaphore( concurrency )
+    executor = futures.ThreadPoolExecutor( concurrency )
+    async def fetchOne( url ):
+        async with semaphore:
+            return await HtmlDom.fetch( url, timeout, executor, fetcher )
+    tasks = [ asyncio.ensure_future( fetchOne( url ) ) for url in urls ]
+    try:
+        return await asyncio.gather( *tasks, return_exceptions = returnExceptions )
+    finally:
+        # after an error or a cancellation the other downloads are dropped. Waiting
+        # for the threads which are still reading would block the event loop, so
+        # they are left to finish on their own.
+        for task in tasks:
+            task.cancel()
+        executor.shutdown( wait = False, cancel_futures = True )
+
+def parseMany( documents, selectors, workers = None, chunkSize = 16 ):
+    """
+        Parses the html documents in a pool of worker processes and yields, for
+        each document in order, a dict mapping every name in selectors to the
+        values of the elements selected by it. selectors maps a name to a css
+        selector, which extracts the text of the elements, or to a ( selector,
+        field ) pair where field is "text", "html" or the name of an attribute
+        ( None for the elements without it ). Only these values come back from
+        the workers. The documents are sent to the workers chunkSize at a time and
+        workers defaults to the number of cpus, workers = 1 parses in this process.
+    """
+    selectors = dict( ( name, ( spec, "text" ) if isinstance( spec, str ) else tuple( spec ) )
+                      for name, spec in selectors.items() )
+    workers = workers or os.cpu_count() or 1
+    documents = iter( documents )
+    chunks = iter( lambda: list( itertools.islice( documents, chunkSize ) ), [] )
+    if workers == 1:
+        for chunk in chunks:
+            for values in extractValues( chunk, selectors ):
+                yield values
+        return
+    with futures.ProcessPoolExecutor( workers ) as pool:
+        # a few chunks are queued per worker, so the workers are kept busy without
+        # reading all the documents up front.
+        pending = collections.deque()
+        try:
+            for chunk in chunks:
+                pending.append( pool.submit( extractValues, chunk, selectors ) )
+                if len( pending ) >= 2 * workers:
+                    for values in pending.popleft().result():
+                        yield values
+            while pending:
+                for values in pending.popleft().result():
+                    yield values
+        finally:
+            for future in pending:
+                future.cancel()
+
+def extractValues( documents, selectors ):
+    """
+        Returns the values parseMany() yields for each of the documents.
+    """
+    results = []
+    for document in documents:
+        dom = HtmlDom()
+        dom.parseHTML( document )
+        values = {}
+        for name, ( selector, field ) in selectors.items():
+            nodes = dom.find( selector ).nodeList
+            if field == "text":
+                values[ name ] = [ node.getText() for node in nodes ]
+            elif field == "html":
+                values[ name ] = [ node.html() for node in nodes ]
+            else:
+                values[ name ] = [ " ".join( node.attributes[ field ] ) if field in node.attributes else None
+                                   for node in nodes ]
+        results.append( values )
+    return results
+
+def parseAttributes( attr, tokens = None ):
+    """
+        Returns the attributes dict of the attribute text of a start tag. Names are
+        interned, and so are the class and id values: through the tokens table of
+        the document when given, else through sys.intern.
+    """
+    #converting multispaces into single space.for easy handling of attributes
+    attr = whiteSpace.sub( ' ', attr.strip() )
+    attrDict = {}
+    for attrName, attrValues in attributeSplitter.findall( attr ):
+        attrName = sys.intern( attrName )
+        values = attrValues.split()
+        if attrName == "class" or attrName == "id":
+            if tokens is None:
+                values = list( map( sys.intern, values ) )
+            else:
+                # the table holds interned copies, so that values parsed either way are shared.
+                values = [ tokens.get( value ) or tokens.setdefault( value, sys.intern( value ) ) for value in values ]
+        attrDict[ attrName ] = values
+    return attrDict
+
+def selectNodes( dom, selectors, nList ):
+    """
+        Returns the nodes of dom selected by selectors, in no particular order, for
+        HtmlDom.find() and HtmlFlatDom.find(). nList is the optional context: only
+        the nodes related to them are selected.
+
+        Matching runs right to left: the candidates of the last compound selector
+        are collected first and then every candidate walks up to its ancestors
+        ( or to its previous sibling for "+" ) to check the remaining ones.
+    """
+    if not isinstance( selectors, CompiledSelector ):
+        selectors = compileSelector( selectors )
+    steps = selectors.steps
+    if not steps:
+        return []
+    context = None
+    if len( nList ) and not steps[0].resetContext:
+        context = set( nList )
+    relations = selectors.relations( context is not None )
+    contextTest = None
+    if context is not None:
+        contextTest = dom.descendantTest( context )
+    start = selectors.start
+    last = len( steps ) - 1
+    memo = {}
+    return [ node for node in stepCandidates( dom, steps[ last ] )
+             if dom.acceptsNode( node, steps[ last ] ) and matchesLeft( dom, node, last, start, steps, relations, context, contextTest, memo ) ]
+
+def selectorMatches( dom, node, selectors, memo = None ):
+    """
+        Checks whether selectNodes( dom, selectors ) would select the node.
+    """
+    if not isinstance( selectors, CompiledSelector ):
+        selectors = compileSelector( selectors )
+    steps = selectors.steps
+    if not steps:
+        return False
+    last = len( steps ) - 1
+    if not dom.matchesStep( node, steps[ last ] ):
+        return False
+    if memo is None:
+        memo = {}
+    return matchesLeft( dom, node, last, selectors.start, steps, selectors.relations( False ), None, None, memo )
+
+def matchesLeft( dom, node, index, start, steps, relations, context, contextTest, memo ):
+    """
+        Checks whether the steps in front of steps[ index ] can be matched by the
+        ancestors/siblings of the node, which already matches steps[ index ]. The
+        tree is walked with dom.parentOf() and dom.previousSiblingOf(), which
+        return None when there is no such node.
+    """
+    relation = relations[ index ]
+    if index == start:
+        if context is None or relation is None:
+            return True
+        if relation == ' ':
+            return contextTest( node )
+        nodeMatches = context.__contains__
+    else:
+        key = ( node, index )
+        if key in memo:
+            return memo[ key ]
+        step = steps[ index - 1 ]
+        def nodeMatches( candidate ):
+            return ( dom.matchesStep( candidate, step ) and
+                     matchesLeft( dom, candidate, index - 1, start, steps, relations, context, contextTest, memo ) )
+
+    result = False
+    if relation == '+':
+        prevNode = dom.previousSiblingOf( node )
+        result = prevNode is not None and nodeMatches( prevNode )
+    elif relation == '>':
+        parent = dom.parentOf( node )
+        result = parent is not None and nodeMatches( parent )
+    else:
+        # ( ancestor, index, " " ) remembers whether the ancestor or one of its own
+        # ancestors matches, so siblings and cousins share the walk up the tree.
+        parentOf = dom.parentOf
+        path = []
+        parent = parentOf( node )
+        while parent is not None:
+            upKey = ( parent, index, ' ' )
+            if upKey in memo:
+                result = memo[ upKey ]
+                break
+            path.append( upKey )
+            if nodeMatches( parent ):
+                result = True
+                break
+            parent = parentOf( parent )
+        for upKey in path:
+            memo[ upKey ] = result
+    if index != start:
+        memo[ key ] = result
+    return result
+
+def stepCandidates( dom, step ):
+    """
+        Returns the nodes of dom which may be selected by the compound selector
+        step, taken from the lookup index that fits it best.
+    """
+    elemName = step.elemName
+    if elemName == "*":
+        return dom.elementNodes()
+    elif elemName:
+        return dom.nodesNamed( elemName )
+    elif step.classSelector:
+        return dom.getNodesWithClassOrId( step.classSelector[-1], selectType = 'class' )
+    elif step.idSelector:
+        return dom.getNodesWithClassOrId( step.idSelector[-1], selectType = 'id' )
+    nodes = {}
+    #new Addition:Mon 13 Feb
+    for a_s, a_f in step.attrList:
+        for node in dom.getNodesWithAttributes( a_s, a_f ):
+            nodes[ node ] = None
+    return nodes
+
+def stepAccepts( step, attributeValues ):
+    """
+        Checks the class, id and attribute parts of a compound selector against a
+        node, whose attribute values are returned by attributeValues( name ) as a
+        list ( None when the node does not carry the attribute ).
+    """
+    if step.classSelector:
+        values = attributeValues( 'class' )
+        if values is None:
+            values = ()
+        for value in step.classSelector:
+            if value not in values:
+                return False
+    if step.idSelector:
+        values = attributeValues( 'id' )
+        if values is None:
+            values = ()
+        for value in step.idSelector:
+            if value not in values:
+                return False
+    for a_s, a_f in step.attrList:
+        key, attrValue = list( a_s.items() )[0]
+        if not attributeAccepts( attributeValues( key ), attrValue, a_f ):
+            return False
+    return True
+
+def attributeAccepts( values, attrValue, attributeSelectorFlags ):
+    """
+        Checks an attribute selector against the values of the attribute, None if
+        the node does not carry it.
+    """
+    if attributeSelectorFlags['$']:
+        return attrValue == ( values if values is not None else [''] )[-1]
+    elif attributeSelectorFlags['^']:
+        return attrValue in ( values if values is not None else [''] )[0]
+    elif attributeSelectorFlags['*']:
+        return attrValue in " ".join( values or [] )
+    elif attributeSelectorFlags['noVal']:
+        return values is not None
+    elif attributeSelectorFlags[ "~" ]:
+        return attrValue in ( values or [] )
+    return attrValue == " ".join( values or [] )
+
+def uniqueNodes( nodes ):
+    """
+        Returns the nodes without duplicates, in the order they are first seen.
+    """
+    return list( dict.fromkeys( nodes ) )
+
+def descendantTest( ancestors ):
+    """
+        Returns a function which tells whether a node is a descendant of any of
+        the ancestors, by comparing their pos/endPos intervals.
+    """
+    ancestorSet = set( ancestors )
+    def walkUp( node ):
+        for parent in node.ancestors():
+            if parent in ancestorSet:
+                return True
+        return False
+    if any( node.pos < 0 for node in ancestorSet ):
+        return walkUp
+    inInterval = intervalTest( ( node.pos, node.endPos ) for node in ancestorSet )
+    def test( node ):
+        if node.pos < 0:
+            return walkUp( node )
+        return inInterval( node.pos )
+    return test
+
+def intervalTest( spans ):
+    """
+        Returns a function which tells whether a position lies inside any of the
+        ( start, end ) spans, start excluded.
+    """
+    spans = sorted( spans )
+    starts = [ start for start, end in spans ]
+    # ends[ i ] is the largest end among the first i + 1 spans.
+    ends = list( itertools.accumulate( ( end for start, end in spans ), max ) )
+    def test( position ):
+        index = bisect.bisect_left( starts, position )
+        return index > 0 and ends[ index - 1 ] > position
+    return test
+
+def startTagSettled( data, start, match ):
+    """
+        Tells whether startTag.match( data, start ) gives the same result when more
+        text is appended to data. The only part of the pattern which can run over
+        "<" or ">" is an attribute value, so the result can change only when the text
+        after the match still reaches a "<" or ">" from inside an opened value: that
+        is when the last quote in front of it follows a "=".
+    """
+    stop = match.end() if match else start + 1
+    boundary = tagBoundary.search( data, stop )
+    if not boundary:
+        return False
+    quote = max( data.rfind( '"', start, boundary.start() ), data.rfind( "'", start, boundary.start() ) )
+    if quote == -1:
+        return True
+    index = quote - 1
+    while index >= start and data[ index ].isspace():
+        index -= 1
+    return data[ index ] != "="
+
+def startTagSearchSettled( data, start, match ):
+    """
+        Same as startTagSettled for startTag.search( data, start ): every "<" the
+        search tried before the match must have failed for good.
+    """
+    index = data.find( "<", start, match.start() )
+    while index != -1:
+        if not startTagSettled( data, index, None ):
+            return False
+        index = data.find( "<", index + 1, match.start() )
+    return startTagSettled( data, match.start(), match )
 
 def createElement( nodeName ):
     return HtmlDomNode( nodeName, 1 )
@@ -1409,8 +3606,53 @@ def createTextElement( nodeVal ):
     elem.setText( nodeVal )
     return elem
     
-def modifyPositions( node, pos = 1 ):
+def modifyPositions( node, pos = 1, step = 1 ):
+    """
+        Numbers node and its descendants in document order, starting with pos
+        and counting in steps of step.
+        Every node gets a pos when it is entered and an endPos when it is left.
+        Returns the last number used.
+    """
     node.pos = pos
-    for chld in node.children:
-        pos = modifyPositions( chld, pos + 1 )
+    if not node.children:
+        node.endPos = pos
+        return pos
+    stack = [ ( node, iter( node.children ) ) ]
+    while stack:
+        parent, children = stack[ -1 ]
+        child = next( children, None )
+        if child is None:
+            stack.pop()
+            pos += step
+            parent.endPos = pos
+        else:
+            pos += step
+            child.pos = pos
+            if child.children:
+                stack.append( ( child, iter( child.children ) ) )
+            else:
+                child.endPos = pos
     return pos
+
+def positionsNeeded( node ):
+    """
+        Returns the count of numbers modifyPositions uses for node and its descendants.
+    """
+    count = 0
+    stack = [ node ]
+    while stack:
+        node = stack.pop()
+        if node.children:
+            count += 2
+            stack.extend( node.children )
+        else:
+            count += 1
+    return count
+
+@functools.lru_cache( maxsize = 1024 )
+def compileSelector( selector ):
+    """
+        Parses a css selector string into a CompiledSelector. The most recently
+        used selectors are cached, so every selector string is parsed only once.
+    """
+    return CompiledSelector( selector )
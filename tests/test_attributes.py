@@ -0,0 +1,67 @@
+"""
+Attributes are parsed when they are first needed: a class, id or attribute
+query only parses the elements whose attribute text can match it.
+"""
+import unittest
+
+from htmldom import htmldom
+
+page = """<html><body>
+<div class="item a" id="first"><a href="/1" title="one">1</a></div>
+<div class="item b"><a href="/2">2</a><span class="price">2.99</span></div>
+<div class="other" data-x="y"><a name="anchor">3</a></div>
+</body></html>"""
+
+class LazyAttributesTest( unittest.TestCase ):
+     def setUp( self ):
+          self.dom = htmldom.HtmlDom().createDom( page )
+
+     def parsed( self ):
+          # html and body have no attribute text to parse.
+          return [ node for node in self.dom.domDictToList()
+                   if node.nodeType == 1 and node.nodeName not in ( "html", "body" ) and node.rawAttributes is None ]
+
+     def testQueryParsesOnlyCandidates( self ):
+          self.assertEqual( self.dom.find( ".price" ).text(), "2.99" )
+          self.assertEqual( [ node.nodeName for node in self.parsed() ], [ "span" ] )
+          self.assertEqual( self.dom.find( "[href]" ).length(), 2 )
+          self.assertEqual( sorted( node.nodeName for node in self.parsed() ), [ "a", "a", "span" ] )
+
+     def testResultsMatchParsedDocument( self ):
+          queries = [ ".item", "#first", "[title]", "[data-x=y]", "div.item > a[href]", ".item, .other", "[name]" ]
+          expected = {}
+          for query in queries:
+               expected[ query ] = self.dom.find( query ).html()
+          # the attributes of every node are read before the queries run.
+          dom = htmldom.HtmlDom().createDom( page )
+          for node in dom.domDictToList():
+               node.attributes
+          for query in queries:
+               self.assertEqual( dom.find( query ).html(), expected[ query ], query )
+
+     def testAttributesReadFirstAreIndexed( self ):
+          div = self.dom.find( "div" ).first()
+          self.assertEqual( div.attr( "id" ), "first" )
+          self.assertEqual( self.dom.find( "#first" ).length(), 1 )
+          self.assertEqual( self.dom.find( ".a" ).length(), 1 )
+
+     def testInsertedNodesAreFound( self ):
+          self.assertEqual( self.dom.find( ".item" ).length(), 2 )
+          self.dom.find( "body" ).append( '<div class="item c"><a href="/4">4</a></div>' )
+          self.assertEqual( self.dom.find( ".item" ).length(), 3 )
+          self.assertEqual( self.dom.find( "[href]" ).length(), 3 )
+          self.dom.find( ".c" ).remove()
+          self.assertEqual( self.dom.find( ".item" ).length(), 2 )
+
+     def testClassValuesAreShared( self ):
+          self.dom.find( ".item" )
+          first = self.dom.find( "div" ).first().nodeList[ 0 ]
+          second = self.dom.find( "div" ).eq( 1 ).nodeList[ 0 ]
+          self.assertIs( first.attributes[ "class" ][ 0 ], second.attributes[ "class" ][ 0 ] )
+          # values read before the document indexed them are interned.
+          dom = htmldom.HtmlDom().createDom( page )
+          divs = dom.find( "div" ).nodeList
+          self.assertIs( divs[ 0 ].attributes[ "class" ][ 0 ], divs[ 1 ].attributes[ "class" ][ 0 ] )
+
+if __name__ == "__main__":
+     unittest.main()
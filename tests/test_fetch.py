@@ -0,0 +1,100 @@
+"""
+fetchAll() against a local http server: a failed or cancelled fetchAll()
+must not block the event loop until the other downloads are done.
+"""
+import asyncio
+import http.server
+import threading
+import time
+import unittest
+import urllib.error
+
+from htmldom import htmldom
+
+slowDelay = 2
+
+class Handler( http.server.BaseHTTPRequestHandler ):
+     def do_GET( self ):
+          if self.path == "/missing":
+               self.send_error( 404 )
+               return
+          if self.path == "/slow":
+               time.sleep( slowDelay )
+          body = b"<html><body><p>page</p></body></html>"
+          self.send_response( 200 )
+          self.send_header( "Content-Type", "text/html; charset=utf-8" )
+          self.send_header( "Content-Length", str( len( body ) ) )
+          self.end_headers()
+          self.wfile.write( body )
+
+     def log_message( self, *args ):
+          pass
+
+class FetchAllTest( unittest.TestCase ):
+     def setUp( self ):
+          self.server = http.server.ThreadingHTTPServer( ( "127.0.0.1", 0 ), Handler )
+          self.server.daemon_threads = True
+          threading.Thread( target = self.server.serve_forever, daemon = True ).start()
+          self.baseURL = "http://127.0.0.1:%d" % self.server.server_address[ 1 ]
+
+     def tearDown( self ):
+          self.server.shutdown()
+          self.server.server_close()
+
+     def runWithHeartbeat( self, coroutine ):
+          """
+               Runs coroutine next to a task which ticks every 10ms and returns the
+               result or error of the coroutine, the time it took and the longest
+               gap between two ticks.
+          """
+          async def main():
+               longest = 0
+               stop = False
+               async def heartbeat():
+                    nonlocal longest
+                    last = time.monotonic()
+                    while not stop:
+                         await asyncio.sleep( 0.01 )
+                         now = time.monotonic()
+                         longest = max( longest, now - last )
+                         last = now
+               beat = asyncio.ensure_future( heartbeat() )
+               start = time.monotonic()
+               try:
+                    outcome = await coroutine
+               except BaseException as e:
+                    outcome = e
+               elapsed = time.monotonic() - start
+               stop = True
+               await beat
+               return outcome, elapsed, longest
+          return asyncio.run( main() )
+
+     def testErrorIsRaisedWithoutWaiting( self ):
+          urls = [ self.baseURL + "/missing", self.baseURL + "/slow" ]
+          outcome, elapsed, longest = self.runWithHeartbeat(
+               htmldom.fetchAll( urls, fetcher = htmldom.HtmlFetcher() ) )
+          self.assertIsInstance( outcome, urllib.error.HTTPError )
+          self.assertLess( elapsed, slowDelay / 2 )
+          self.assertLess( longest, slowDelay / 4 )
+
+     def testCancelDoesNotBlock( self ):
+          urls = [ self.baseURL + "/slow" ] * 2
+          async def cancelled():
+               task = asyncio.ensure_future( htmldom.fetchAll( urls, fetcher = htmldom.HtmlFetcher() ) )
+               await asyncio.sleep( 0.2 )
+               task.cancel()
+               await task
+          outcome, elapsed, longest = self.runWithHeartbeat( cancelled() )
+          self.assertIsInstance( outcome, asyncio.CancelledError )
+          self.assertLess( elapsed, slowDelay / 2 )
+          self.assertLess( longest, slowDelay / 4 )
+
+     def testReturnsDomsInOrder( self ):
+          urls = [ self.baseURL + "/fast", self.baseURL + "/missing" ]
+          doms = asyncio.run( htmldom.fetchAll( urls, returnExceptions = True, fetcher = htmldom.HtmlFetcher() ) )
+          self.assertEqual( doms[ 0 ].find( "p" ).length(), 1 )
+          self.assertIsInstance( doms[ 1 ], urllib.error.HTTPError )
+
+if __name__ == "__main__":
+     unittest.main()
@@ -0,0 +1,191 @@
+"""
+HtmlFetcher against a local http server: kept connections, compressed bodies,
+conditional requests served from the cache, redirects and errors.
+"""
+import gzip
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import zlib
+from unittest import mock
+
+from htmldom import htmldom
+
+page = b"<html><body><p>page</p></body></html>"
+etag = '"v1"'
+lastModified = "Sat, 17 Oct 2026 10:00:00 GMT"
+
+class Server( http.server.ThreadingHTTPServer ):
+     daemon_threads = True
+
+     def __init__( self, *args ):
+          http.server.ThreadingHTTPServer.__init__( self, *args )
+          #@var:connections counts the accepted connections.
+          self.connections = 0
+          #@var:statuses holds the status sent for each path, in order.
+          self.statuses = []
+
+     def verify_request( self, request, clientAddress ):
+          self.connections += 1
+          return True
+
+class Handler( http.server.BaseHTTPRequestHandler ):
+     # connections are kept open between requests.
+     protocol_version = "HTTP/1.1"
+
+     def do_GET( self ):
+          path = self.path
+          headers = {}
+          body = page
+          if path == "/missing":
+               self.reply( 404, {}, b"not here" )
+               return
+          if path == "/redirect":
+               self.reply( 302, { "Location": "/moved" }, b"" )
+               return
+          if path == "/gzip":
+               headers[ "Content-Encoding" ] = "gzip"
+               body = gzip.compress( page )
+          elif path == "/deflate":
+               headers[ "Content-Encoding" ] = "deflate"
+               body = zlib.compress( page )
+          elif path == "/rawdeflate":
+               # deflate data without the zlib header, as some servers send it.
+               compressor = zlib.compressobj( wbits = -zlib.MAX_WBITS )
+               headers[ "Content-Encoding" ] = "deflate"
+               body = compressor.compress( page ) + compressor.flush()
+          elif path == "/etag":
+               if self.headers.get( "If-None-Match" ) == etag:
+                    self.reply( 304, {}, b"" )
+                    return
+               headers[ "ETag" ] = etag
+          elif path == "/modified":
+               if self.headers.get( "If-Modified-Since" ) == lastModified:
+                    self.reply( 304, {}, b"" )
+                    return
+               headers[ "Last-Modified" ] = lastModified
+          self.reply( 200, headers, body )
+          if path == "/drop":
+               # the connection is closed without telling the client.
+               self.close_connection = True
+
+     def reply( self, status, headers, body ):
+          self.server.statuses.append( ( self.path, status ) )
+          self.send_response( status )
+          self.send_header( "Content-Type", "text/html; charset=utf-8" )
+          self.send_header( "Content-Length", str( len( body ) ) )
+          for name, value in headers.items():
+               self.send_header( name, value )
+          self.end_headers()
+          self.wfile.write( body )
+
+     def log_message( self, *args ):
+          pass
+
+class HtmlFetcherTest( unittest.TestCase ):
+     def setUp( self ):
+          # requests to the local server must not go through a proxy.
+          environ = dict( ( name, value ) for name, value in os.environ.items() if not name.lower().endswith( "_proxy" ) )
+          patcher = mock.patch.dict( os.environ, environ, clear = True )
+          patcher.start()
+          self.addCleanup( patcher.stop )
+          self.server = Server( ( "127.0.0.1", 0 ), Handler )
+          threading.Thread( target = self.server.serve_forever, kwargs = { "poll_interval": 0.05 }, daemon = True ).start()
+          self.baseURL = "http://127.0.0.1:%d" % self.server.server_address[ 1 ]
+          self.cacheDir = tempfile.mkdtemp()
+          self.fetcher = htmldom.HtmlFetcher( self.cacheDir, timeout = 5 )
+
+     def tearDown( self ):
+          for connection in getattr( self.fetcher.local, "connections", {} ).values():
+               connection.close()
+          self.server.shutdown()
+          self.server.server_close()
+          shutil.rmtree( self.cacheDir )
+
+     def read( self, path ):
+          return self.fetcher.read( self.baseURL + path )
+
+     def testConnectionIsKeptOpen( self ):
+          for i in range( 5 ):
+               body, contentType = self.read( "/page" )
+               self.assertEqual( body, page )
+          self.assertEqual( contentType, "text/html; charset=utf-8" )
+          self.assertEqual( self.server.connections, 1 )
+
+     def testCompressedBodies( self ):
+          for path in ( "/gzip", "/deflate", "/rawdeflate" ):
+               body, contentType = self.read( path )
+               self.assertEqual( body, page, path )
+          self.assertEqual( self.server.connections, 1 )
+
+     def testDecodeBody( self ):
+          compressor = zlib.compressobj( wbits = -zlib.MAX_WBITS )
+          raw = compressor.compress( page ) + compressor.flush()
+          self.assertEqual( htmldom.decodeBody( raw, "deflate" ), page )
+          self.assertEqual( htmldom.decodeBody( zlib.compress( page ), " Deflate " ), page )
+          self.assertEqual( htmldom.decodeBody( gzip.compress( page ), "x-gzip" ), page )
+          self.assertEqual( htmldom.decodeBody( page, None ), page )
+
+     def testETagIsRevalidated( self ):
+          self.assertEqual( self.read( "/etag" )[ 0 ], page )
+          body, contentType = self.read( "/etag" )
+          self.assertEqual( body, page )
+          self.assertEqual( contentType, "text/html; charset=utf-8" )
+          self.assertEqual( self.server.statuses, [ ( "/etag", 200 ), ( "/etag", 304 ) ] )
+
+     def testLastModifiedIsRevalidated( self ):
+          self.assertEqual( self.read( "/modified" )[ 0 ], page )
+          self.assertEqual( self.read( "/modified" )[ 0 ], page )
+          self.assertEqual( self.server.statuses, [ ( "/modified", 200 ), ( "/modified", 304 ) ] )
+
+     def testCacheIsSharedByFetchers( self ):
+          self.read( "/etag" )
+          fetcher = htmldom.HtmlFetcher( self.cacheDir )
+          try:
+               self.assertEqual( fetcher.read( self.baseURL + "/etag" )[ 0 ], page )
+          finally:
+               for connection in fetcher.local.connections.values():
+                    connection.close()
+          self.assertEqual( self.server.statuses[ -1 ], ( "/etag", 304 ) )
+
+     def testWithoutCacheDirNothingIsStored( self ):
+          fetcher = htmldom.HtmlFetcher()
+          try:
+               fetcher.read( self.baseURL + "/etag" )
+               fetcher.read( self.baseURL + "/etag" )
+          finally:
+               for connection in fetcher.local.connections.values():
+                    connection.close()
+          self.assertEqual( self.server.statuses, [ ( "/etag", 200 ), ( "/etag", 200 ) ] )
+
+     def testRedirectIsFollowed( self ):
+          body, contentType = self.read( "/redirect" )
+          self.assertEqual( body, page )
+          self.assertEqual( self.server.statuses, [ ( "/redirect", 302 ), ( "/moved", 200 ) ] )
+          self.assertEqual( self.server.connections, 1 )
+
+     def testMissingPageRaises( self ):
+          with self.assertRaises( urllib.error.HTTPError ) as raised:
+               self.read( "/missing" )
+          self.assertEqual( raised.exception.code, 404 )
+          self.assertEqual( raised.exception.read(), b"not here" )
+          # the connection can still be used.
+          self.assertEqual( self.read( "/page" )[ 0 ], page )
+          self.assertEqual( self.server.connections, 1 )
+
+     def testDroppedConnectionIsReopened( self ):
+          self.assertEqual( self.read( "/drop" )[ 0 ], page )
+          self.assertEqual( self.read( "/page" )[ 0 ], page )
+          self.assertEqual( self.server.connections, 2 )
+
+     def testReadURL( self ):
+          dom = htmldom.HtmlDom( self.baseURL + "/gzip" )
+          dom.parseHTML( dom.readURL( fetcher = self.fetcher ) )
+          self.assertEqual( dom.find( "p" ).text(), "page" )
+
+if __name__ == "__main__":
+     unittest.main()
@@ -0,0 +1,58 @@
+"""
+Node numbers ( HtmlDomNode.pos/endPos ) must stay in document order while
+nodes are inserted, however often they are inserted at the same spot.
+"""
+import unittest
+
+from htmldom import htmldom
+
+def documentNodes( dom ):
+     nodes = []
+     stack = list( reversed( dom.topLevelNodes ) )
+     while stack:
+          node = stack.pop()
+          nodes.append( node )
+          stack.extend( reversed( node.children ) )
+     return nodes
+
+class PositionsTest( unittest.TestCase ):
+     def tableDom( self, rows ):
+          html = "<html><body><table>%s</table></body></html>" % "".join( "<tr><td>%d</td></tr>" % i for i in range( rows ) )
+          return htmldom.HtmlDom().createDom( html )
+
+     def assertOrdered( self, dom ):
+          nodes = documentNodes( dom )
+          for node, nextNode in zip( nodes, nodes[ 1: ] ):
+               self.assertLess( node.pos, nextNode.pos )
+          for node in nodes:
+               if node.children:
+                    self.assertLess( node.children[ -1 ].endPos, node.endPos )
+               else:
+                    self.assertEqual( node.pos, node.endPos )
+
+     def assertInsertsOrdered( self, method ):
+          dom = self.tableDom( 200 )
+          row = dom.find( "tr" ).eq( 100 )
+          for i in range( 2000 ):
+               getattr( row, method )( "<tr><td>new %d</td></tr>" % i )
+          self.assertOrdered( dom )
+          self.assertEqual( dom.find( "tr" ).length(), 2200 )
+          self.assertEqual( dom.find( "tr" ).eq( 100 ).text().strip(), "new 0" if method == "before" else "100" )
+
+     def testAfterSameRow( self ):
+          self.assertInsertsOrdered( "after" )
+
+     def testBeforeSameRow( self ):
+          self.assertInsertsOrdered( "before" )
+
+     def testNestedInserts( self ):
+          dom = self.tableDom( 50 )
+          cell = dom.find( "td" ).eq( 25 )
+          for i in range( 500 ):
+               cell.after( "<td><b>%d</b></td>" % i )
+               dom.find( "tr" ).eq( 25 ).after( "<tr><td>row %d</td></tr>" % i )
+          self.assertOrdered( dom )
+          self.assertEqual( dom.find( "td b" ).length(), 500 )
+
+if __name__ == "__main__":
+     unittest.main()